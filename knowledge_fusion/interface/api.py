@@ -1,4 +1,5 @@
 import configparser
+import json
 import logging
 import os
 import traceback
@@ -7,7 +8,7 @@ from celery import Celery
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
-from knowledge_fusion.interface.mapping import match_all_interrelation, match_one2all_interrelation, match_one2one_interrelation, match_some2all_interrelation
+from knowledge_fusion.interface.mapping import match_all_interrelation, match_incremental_interrelation, match_one2all_interrelation, match_one2one_interrelation, match_some2all_interrelation, mapping_extractor, pair_store, profile
 from knowledge_fusion.settings import BASE_DIR, config_dir
 from knowledge_fusion.interface.task_db import TaskDB
 from knowledge_fusion.utils.utils import get_cur_time_rep
@@ -24,6 +25,13 @@ def response(**kwargs):
     return JsonResponse({str(key): value for key, value in kwargs.items()}, json_dumps_params={'ensure_ascii': False}, safe=False)
 
 
+def request_profile(request):
+    """
+    请求参数profile为true时对该任务做性能剖析，为false时不剖析，未指定时按配置决定
+    """
+    return request.POST.get('profile', str(profile)).lower() == 'true'
+
+
 @csrf_exempt
 def test_api(request):
     if request.method not in ['GET', 'POST']:
@@ -31,6 +39,32 @@ def test_api(request):
     return response(code=200, msg='接口运行正常')
 
 
+@csrf_exempt
+def cache_metrics(request):
+    """
+    缓存效果查询接口
+    指定taskId时返回该任务执行期间各缓存的命中、未命中、淘汰次数与缓存大小，否则返回最近一个任务的统计
+    """
+    logger.info('**********Access cache_metrics api.**********')
+    if request.method not in ['GET', 'POST']:
+        return response(message='仅支持GET或POST访问')
+    task_id = request.POST.get('taskId') if request.method == 'POST' else request.GET.get('taskId')
+    try:
+        if task_id is None:
+            latest = task_db.select_latest('content', table='metrics')
+            if latest is None:
+                return response(status=-1, message='没有缓存统计信息')
+            task_id, content = latest
+        else:
+            content = task_db.select_by_task_id(task_id, 'content', table='metrics')
+            if content is None:
+                return response(taskId=task_id, status=-1, message='taskId不存在')
+        return response(taskId=task_id, status=1, metrics=json.loads(content))
+    except Exception:
+        logger.error(traceback.format_exc())
+        return response(taskId=task_id, status=-1, message='查询缓存统计时发生错误')
+
+
 # ! 貌似总是返回1或-1
 @csrf_exempt
 def task_state(request):
@@ -54,10 +88,12 @@ def task_state(request):
         logger.info(result.state + '-------------------------')
         status = 1 if result.state == 'SUCCESS' else -1 if result.state == 'FAILURE' or result.state == 'REVOKED' else 0
         info = str(result.info).replace("'", '')
+        timing = task_db.select_by_task_id(task_id, 'content', table='timing')
+        timing = None if timing is None else json.loads(timing)
         if isinstance(result.info, Exception):
-            return response(taskId=int(task_id), status=status, message=result.info.__class__.__name__ + ': ' + info)
+            return response(taskId=int(task_id), status=status, message=result.info.__class__.__name__ + ': ' + info, timing=timing)
         else:
-            return response(taskId=int(task_id),status=status, message=info)
+            return response(taskId=int(task_id),status=status, message=info, timing=timing)
     except Exception:
         logger.error(traceback.format_exc())
         return response(taskId=task_id, status=-1, message='查询状态时发生错误')
@@ -68,9 +104,12 @@ def delete_cache(request):
     """
     不太清楚这个功能想要做什么
     不用调用该接口，每次访问接口结束即删除所有缓存的表数据，否则表变化后查询到的是旧数据
-    如果调用该接口，则清空数据库TaskDB
+    如果调用该接口，则清空数据库TaskDB、保存的表对匹配结果与字段特征
     """
     task_db.clear()
+    if pair_store is not None:
+        pair_store.clear()
+    mapping_extractor.clear_store()
     return response(status=True)
 
 
@@ -93,7 +132,32 @@ def all_interrelation(request):
         logger.error('Error parsing parameters')
         return response(state=False, message='参数错误')
     try:
-        result = match_all_interrelation.delay(task_id, table_id_list)
+        result = match_all_interrelation.delay(task_id, table_id_list, profile=request_profile(request))
+        pid = result.id
+        task_db.insert(task_id, pid, get_cur_time_rep())
+        return response(state=True)
+    except Exception:
+        logger.error('Error when matching or inserting info into database')
+        return response(state=False)
+
+
+@csrf_exempt
+def incremental_interrelation(request):
+    """
+    所有资产相互间的增量关系运算，只重新计算涉及内容变化资产的表对，只回调关系变化的字段
+    """
+    logger.info('**********Access incremental_interrelation api.**********')
+    if request.method != 'POST':
+        return response(state=False, message='仅支持POST访问')
+    try:
+        task_id = request.POST.get('taskId')
+        table_id_list = request.POST.getlist('tableIdList')
+        logger.info('Request taskId: %s', task_id)
+    except Exception:
+        logger.error('Error parsing parameters')
+        return response(state=False, message='参数错误')
+    try:
+        result = match_incremental_interrelation.delay(task_id, table_id_list, profile=request_profile(request))
         pid = result.id
         task_db.insert(task_id, pid, get_cur_time_rep())
         return response(state=True)
@@ -119,7 +183,7 @@ def one2all_interrelation(request):
         logger.error('Error parsing parameters: %s')
         return response(state=False, message='参数错误')
     try:
-        result = match_one2all_interrelation.delay(task_id, table_id_src, table_id_list_dest)
+        result = match_one2all_interrelation.delay(task_id, table_id_src, table_id_list_dest, profile=request_profile(request))
         pid = result.id
         task_db.insert(task_id, pid, get_cur_time_rep())
         return response(state=True, table_id_list_dest=table_id_list_dest)
@@ -145,7 +209,7 @@ def one2one_interrelation(request):
         logger.error('Error parsing parameters: %s')
         return response(message='参数错误')
     try:
-        result = match_one2one_interrelation.delay(task_id, table_id_src, table_id_dest)
+        result = match_one2one_interrelation.delay(task_id, table_id_src, table_id_dest, profile=request_profile(request))
         pid = result.id
         task_db.insert(task_id, pid, get_cur_time_rep())
         return response(state=True)
@@ -171,7 +235,7 @@ def some2all_interrelation(request):
         logger.error('Error parsing parameters: %s')
         return response(message='参数错误')
     try:
-        result = match_some2all_interrelation.delay(task_id, table_id_list_src, table_id_list_dest)
+        result = match_some2all_interrelation.delay(task_id, table_id_list_src, table_id_list_dest, profile=request_profile(request))
         pid = result.id
         task_db.insert(task_id, pid, get_cur_time_rep())
         return response(state=True)
@@ -5,11 +5,14 @@ import os
 import random
 import time
 
-import requests
+import numpy as np
 
+from knowledge_fusion.interface import http_client, sampler
+from knowledge_fusion.interface.json_stream import JsonStream
 from knowledge_fusion.settings import BASE_DIR
-from knowledge_fusion.utils.LRUDict import LRUDict
-from knowledge_fusion.utils.utils import default_return
+from knowledge_fusion.utils import timer
+from knowledge_fusion.utils.LRUCache import LRUCache
+from knowledge_fusion.utils.utils import content_hash, default_return
 
 logger = logging.getLogger('server_log')
 
@@ -19,6 +22,13 @@ post_url = config.get('ip', 'post_url')
 get_url = config.get('ip', 'get_url')
 result_url = config.get('ip', 'result_url')
 page_size = int(config.get('data', 'page_size'))
+fields_chunk_size = int(config.get('data', 'fields_chunk_size'))
+sample_mode = config.get('data', 'sample_mode').lower()
+sample_size = int(config.get('data', 'sample_size'))
+sample_seed = config.get('data', 'sample_seed')
+stream_chunk_size = int(config.get('data', 'stream_chunk_size'))
+if sample_mode not in sampler.SAMPLE_MODES:
+    raise Exception('sample_mode必须为{}之一'.format(', '.join(sampler.SAMPLE_MODES)))
 pool_size = int(config.get('process', 'pool_size'))
 post_result_path = os.path.join(BASE_DIR, config.get('path', 'post_result_path'))
 
@@ -39,7 +49,7 @@ def request_fields_info(asset_ids):
     根据资产ID列表查询资产表结构信息
     """
     logger.info('Request fields info. assetIds: {}'.format(asset_ids))
-    return json.loads(requests.post(post_url, {'assetIds': asset_ids}).text)
+    return json.loads(http_client.post(post_url, {'assetIds': asset_ids}).text)
 
 
 def request_data_info(asset_id, limit=None):
@@ -48,18 +58,28 @@ def request_data_info(asset_id, limit=None):
     """
     logger.info('Request data info. asset_id: {}'.format(asset_id))
     if limit is None:
-        return json.loads(requests.get(get_url, params={'asset_id': asset_id}).text)
+        return json.loads(http_client.get(get_url, params={'asset_id': asset_id}).text)
     else:
-        return json.loads(requests.get(get_url, params={'asset_id': asset_id, 'limit': limit}).text)
+        return json.loads(http_client.get(get_url, params={'asset_id': asset_id, 'limit': limit}).text)
+
+
+def request_data_stream(asset_id, limit=None):
+    """
+    根据资产ID查询资产表数据，返回流式读取的响应，调用者负责关闭
+    """
+    logger.info('Request data stream. asset_id: {}'.format(asset_id))
+    params = {'asset_id': asset_id} if limit is None else {'asset_id': asset_id, 'limit': limit}
+    return http_client.get(get_url, params=params, stream=True)
 
 
 def call_back_result(data):
     post_time = time.time()
-    result = requests.post(result_url, data)
+    result = http_client.post(result_url, data)
     logger.info('Call back taskId: {}, pageNum: {}, time:{}'.format(data["taskId"], data["pageNum"], time.time() - post_time))
     return result
 
 
+@timer.timed('post_result')
 def post_result(task_id, result):
     """
     计算结果 数据回调接口
@@ -95,20 +115,81 @@ def post_result(task_id, result):
         json.dump(all_data, file)
 
 
+class Column:
+    """
+    字典编码的字段数据，values为按首次出现的顺序排列的不同的值，counts为每个值出现的次数
+    """
+
+    __slots__ = ('values', 'counts')
+
+    def __init__(self, values, counts):
+        self.values = values
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_list(cls, data):
+        index = {}
+        counts = []
+        for item in data:
+            i = index.get(item)
+            if i is None:
+                index[item] = len(counts)
+                counts.append(1)
+            else:
+                counts[i] += 1
+        return cls(list(index), counts)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def digest(self):
+        """
+        字段数据的哈希，不同的值及其次数都相同时哈希相同，用作字段内容的版本
+        """
+        return content_hash(self.values, self.counts.tobytes())
+
+
+class ColumnBuilder:
+    """
+    逐行追加数据，直接构造字典编码的字段，不保存原始的行
+    """
+
+    __slots__ = ('_index', '_counts')
+
+    def __init__(self):
+        self._index = {}
+        self._counts = []
+
+    def append(self, value):
+        i = self._index.get(value)
+        if i is None:
+            self._index[value] = len(self._counts)
+            self._counts.append(1)
+        else:
+            self._counts[i] += 1
+
+    def build(self):
+        return Column(list(self._index), self._counts)
+
+
 class Asset:
 
     """
     通用的关系图谱调用接口
-    使用LRU字典缓存最近访问数据；请求完成，数据需要被删除
+    使用LRU缓存最近访问数据；请求完成，数据需要被删除
     对于调用者屏蔽访问细节
     """
 
-    data_dict = LRUDict(int(config.get('data', 'cache_data_size')))
-    fields_dict = LRUDict(int(config.get('data', 'cache_fields_size')))
+    data_dict = LRUCache(int(config.get('data', 'cache_data_size')), int(config.get('data', 'cache_data_bytes')), int(config.get('data', 'cache_data_ttl')), name='Asset.data_dict')
+    fields_dict = LRUCache(int(config.get('data', 'cache_fields_size')), int(config.get('data', 'cache_fields_bytes')), int(config.get('data', 'cache_data_ttl')), name='Asset.fields_dict')
+    # 表中各字段数据的哈希，表数据被淘汰后仍保留，不需要重新获取数据就能得到表的内容版本
+    digest_dict = LRUCache(int(config.get('data', 'cache_fields_size')), int(config.get('data', 'cache_fields_bytes')), int(config.get('data', 'cache_data_ttl')), name='Asset.digest_dict')
+    # 测试模式下每个字段在一个任务中只选择一次逻辑名的变体，候选过滤与打分使用相同的逻辑名，任务结束时由clear清空
+    logic_name_dict = {}
 
     @classmethod
-    @default_return(value=[])
-    def get_data_by_id(cls, table_id, field_id):
+    @default_return(value=Column([], []))
+    def get_column_by_id(cls, table_id, field_id):
         all_data = cls.data_dict[table_id]
         if all_data is None:
             cls._update_data(table_id)
@@ -118,13 +199,18 @@ class Asset:
     @classmethod
     @default_return(value='')
     def get_field_logic_name_by_id(cls, table_id, field_id):
+        logic_name = cls.logic_name_dict.get((table_id, field_id))
+        if logic_name is not None:
+            return logic_name
         fields = cls.fields_dict[table_id]
         if fields is None:
             cls._update_fields(table_id)
-            field = cls.fields_dict[table_id].get(field_id)
-            return cls._choose(field[1] if field is not None else None)
+            fields = cls.fields_dict[table_id]
         field = fields.get(field_id)
-        return cls._choose(field[1] if field is not None else None)
+        logic_name = cls._choose(field[1] if field is not None else None)
+        if test and logic_name is not None:
+            cls.logic_name_dict[(table_id, field_id)] = logic_name
+        return logic_name
 
     @classmethod
     @default_return(value=[])
@@ -144,23 +230,72 @@ class Asset:
             return cls.fields_dict[table_id]
         return fields
 
+    @classmethod
+    def get_column_digest(cls, table_id, field_id):
+        """
+        字段数据的哈希，表数据未获取时先获取
+        """
+        digests = cls.digest_dict[table_id]
+        if digests is None:
+            cls._update_data(table_id)
+            digests = cls.digest_dict[table_id]
+        digest = digests.get(field_id)
+        return digest if digest is not None else Column([], []).digest()
+
+    @classmethod
+    def get_table_version(cls, table_id):
+        """
+        表的内容版本，由所有字段的ID、物理名、逻辑名与数据的哈希得到，任何一项变化时版本都会变化
+        """
+        fields = cls.get_fields_by_table_id(table_id)
+        items = [[str(field_id), physics_name, logic_name, cls.get_column_digest(table_id, field_id)] for field_id, (physics_name, logic_name) in fields.items()]
+        items.sort(key=lambda item: item[0])
+        return content_hash(items)
+
+    @classmethod
+    def prefetch_fields(cls, table_id_list):
+        """
+        分批批量查询所有未缓存表的字段信息并写入缓存，避免匹配时逐表请求
+        批量请求失败或没有返回的表不写入缓存，之后仍按单表查询
+        """
+        table_id_list = [table_id for table_id in dict.fromkeys(table_id_list) if cls.fields_dict[table_id] is None]
+        for i in range(0, len(table_id_list), fields_chunk_size):
+            chunk = {str(table_id): table_id for table_id in table_id_list[i:i + fields_chunk_size]}
+            for table in cls._select_fields_info(list(chunk.values())):
+                table_id = chunk.get(str(table['id']))
+                if table_id is not None:
+                    cls._set_fields(table_id, table['fieldList'])
+
     @classmethod
     def _update_fields(cls, table_id):
-        cls.fields_dict[table_id] = {}
         fields = cls._select_fields_info([table_id])
-        if len(fields) > 0:
-            for field in fields[0]['fieldList']:
-                cls.fields_dict[table_id][field['id']] = (field['physicsName'], field['logicName'])
+        cls._set_fields(table_id, fields[0]['fieldList'] if len(fields) > 0 else [])
+
+    @classmethod
+    def _set_fields(cls, table_id, field_list):
+        cls.fields_dict[table_id] = {field['id']: (field['physicsName'], field['logicName']) for field in field_list}
 
     @classmethod
     def _update_data(cls, table_id):
-        cls.data_dict[table_id] = {}
+        timer.count('data_fetch')
+        data = {}
         all_data = cls._select_data_info(table_id)
         fields = cls.get_fields_by_table_id(table_id)
         id_dict = {value[0]: key for key, value in fields.items()}
-        for field, data in zip(all_data[0], all_data[1]):
+        for field, column in zip(all_data[0], all_data[1]):
             if id_dict.get(field) is not None:
-                cls.data_dict[table_id][id_dict.get(field)] = data
+                if sample_mode == 'stratified':
+                    column = Column(*sampler.stratified(column.values, column.counts, sample_size, cls._random(table_id)))
+                data[id_dict.get(field)] = column
+        cls.data_dict[table_id] = data
+        cls.digest_dict[table_id] = {field_id: column.digest() for field_id, column in data.items()}
+
+    @classmethod
+    def _random(cls, table_id):
+        """
+        每张表使用固定种子的随机数生成器，保证同一张表多次采样的结果一致，便于评估采样对匹配效果的影响
+        """
+        return random.Random('{}:{}'.format(sample_seed, table_id))
 
     @classmethod
     def _choose(cls, logic_name):
@@ -177,8 +312,11 @@ class Asset:
     def clear(cls):
         cls.data_dict.clear()
         cls.fields_dict.clear()
+        cls.digest_dict.clear()
+        cls.logic_name_dict.clear()
 
     @classmethod
+    @timer.timed('fetch')
     def _select_fields_info(cls, table_list_id):
         """
         对request_fields_info的进一步封装
@@ -190,21 +328,38 @@ class Asset:
         return fields_info['data']
 
     @classmethod
+    @timer.timed('fetch')
     def _select_data_info(cls, table_id):
         """
-        对request_data_info的进一步封装
+        对request_data_stream的进一步封装，按配置对行采样
+        流式解析响应，每一行直接追加到对应字段的ColumnBuilder中，不保存整个响应与原始的行
         """
-        data_info = request_data_info(table_id)
-        if data_info['message'] != 'SUCCESS':
+        builders = []
+
+        def append(row):
+            if len(builders) < len(row):
+                builders.extend(ColumnBuilder() for _ in range(len(row) - len(builders)))
+            for builder, value in zip(builders, row):
+                builder.append(value)
+
+        row_cnt = 0
+
+        def append_head(row):
+            nonlocal row_cnt
+            if row_cnt < sample_size:
+                append(row)
+            row_cnt += 1
+
+        reservoir = sampler.Reservoir(sample_size, cls._random(table_id))
+        on_item = append_head if sample_mode == 'head' else reservoir.add if sample_mode == 'reservoir' else append
+        with request_data_stream(table_id, sample_size if sample_mode == 'head' else None) as response:
+            data_info = JsonStream(response.iter_content(chunk_size=stream_chunk_size), ('data', 'assetData'), on_item).parse()
+        if data_info.get('message') != 'SUCCESS':
             logger.info('No data info exist for asset_id {}'.format(table_id))
             return [[], []]
-        data_info = data_info['data']
-        fields = data_info['fieldName']
-        data = []
-        length = len(fields)
-        for i in range(0, length):
-            data.append([])
-        for item in data_info['assetData']:
-            for i in range(0, length):
-                data[i].append(item[i])
-        return fields, data
\ No newline at end of file
+        if sample_mode == 'reservoir':
+            for row in reservoir.rows():
+                append(row)
+        fields = data_info['data']['fieldName']
+        builders.extend(ColumnBuilder() for _ in range(len(fields) - len(builders)))
+        return fields, [builder.build() for builder in builders[:len(fields)]]
@@ -0,0 +1,63 @@
+import configparser
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from knowledge_fusion.settings import config_dir
+
+logger = logging.getLogger('server_log')
+
+config = configparser.ConfigParser()
+config.read(config_dir, encoding='utf-8')
+pool_size = int(config.get('ip', 'pool_size'))
+timeout = (float(config.get('ip', 'connect_timeout')), float(config.get('ip', 'read_timeout')))
+retries = int(config.get('ip', 'retries'))
+backoff_factor = float(config.get('ip', 'backoff_factor'))
+gzip = True if config.get('ip', 'gzip').lower() == 'true' else False
+
+_lock = threading.Lock()
+_sessions = {}
+
+
+def _retry():
+    """
+    读取超时与5xx只对幂等的方法（urllib3的默认方法，不含POST）重试，
+    回调结果的POST不是幂等的，服务端已接受请求后重发会产生重复的回调，只在连接失败、请求尚未发出时重试
+    """
+    return Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff_factor, status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+
+
+def get_session():
+    """
+    获取当前进程共享的连接池会话，连接保持复用
+    celery的worker进程由fork创建，连接不能跨进程共享，因此每个进程单独创建会话
+    """
+    pid = os.getpid()
+    session = _sessions.get(pid)
+    if session is None:
+        with _lock:
+            session = _sessions.get(pid)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=_retry())
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+                _sessions.clear()
+                _sessions[pid] = session
+                logger.info('Create http session. pid: {}, pool_size: {}'.format(pid, pool_size))
+    return session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', timeout)
+    return get_session().get(url, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+    kwargs.setdefault('timeout', timeout)
+    return get_session().post(url, data, **kwargs)
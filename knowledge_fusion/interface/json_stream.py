@@ -0,0 +1,116 @@
+import codecs
+import json
+
+
+class JsonStream:
+    """
+    增量解析JSON响应，path指定的数组的元素逐个解码后交给on_item处理而不保存
+    parse返回不含该数组的JSON对象，峰值内存与单个数组元素的大小相当
+    """
+
+    _whitespace = ' \t\n\r'
+
+    def __init__(self, chunks, path, on_item):
+        self._chunks = iter(chunks)
+        self._path = path
+        self._on_item = on_item
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def parse(self):
+        if self._peek() != '{':
+            return self._value()
+        return self._object(0)
+
+    def _object(self, depth):
+        self._expect('{')
+        result = {}
+        if self._peek() == '}':
+            self._pos += 1
+            return result
+        while True:
+            key = self._value()
+            self._expect(':')
+            if depth < len(self._path) and key == self._path[depth]:
+                if depth == len(self._path) - 1 and self._peek() == '[':
+                    self._array()
+                elif depth < len(self._path) - 1 and self._peek() == '{':
+                    result[key] = self._object(depth + 1)
+                else:
+                    result[key] = self._value()
+            else:
+                result[key] = self._value()
+            c = self._next()
+            if c == '}':
+                return result
+            if c != ',':
+                raise ValueError('Expecting , or }} at {}'.format(self._pos))
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            self._on_item(self._value())
+            c = self._next()
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError('Expecting , or ] at {}'.format(self._pos))
+
+    def _value(self):
+        """
+        解码一个完整的JSON值，数据不完整时继续读取
+        解码成功但恰好到达缓冲区末尾时也继续读取，避免数字等值被数据块截断
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buf, self._pos)
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _expect(self, c):
+        if self._next() != c:
+            raise ValueError('Expecting {} at {}'.format(c, self._pos))
+
+    def _next(self):
+        c = self._peek()
+        self._pos += 1
+        return c
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _fill(self):
+        """
+        读取下一块数据并丢弃已解析的部分，没有更多数据时返回False
+        """
+        if self._eof:
+            return False
+        text = ''
+        for chunk in self._chunks:
+            text = self._text_decoder.decode(chunk)
+            if len(text) > 0:
+                break
+        else:
+            text = self._text_decoder.decode(b'', final=True)
+            self._eof = True
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        return len(text) > 0 or not self._eof
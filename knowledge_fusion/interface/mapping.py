@@ -1,14 +1,25 @@
 import configparser
+import json
 import logging
 import os
+import time
 from collections import defaultdict
 from functools import wraps
 
+from billiard import Pool
 from celery import Celery
 
-from knowledge_fusion.matcher.mapping_extractor import MappingExtractor
+from knowledge_fusion.matcher.field_cluster import FieldCluster
+from knowledge_fusion.matcher.mapping_extractor import MappingExtractor, canonical_pair
+from knowledge_fusion.preprocess.tokenizer import Tokenizer
 from knowledge_fusion.settings import config_dir, BASE_DIR
+from knowledge_fusion.interface import scheduler
 from knowledge_fusion.interface.asset import post_result, Asset
+from knowledge_fusion.interface.pair_store import PairStore
+from knowledge_fusion.interface.task_db import TaskDB
+from knowledge_fusion.utils import profiler, timer
+from knowledge_fusion.utils.metrics import cache_metrics, cache_metrics_delta, merge_cache_metrics
+from knowledge_fusion.utils.utils import get_cur_time_rep
 
 logger = logging.getLogger('match_log')
 config = configparser.ConfigParser()
@@ -18,6 +29,28 @@ app = Celery('field_matcher', broker=config.get('celery', 'broker'), backend=con
 
 config.read(os.path.join(BASE_DIR, 'config.ini'), encoding='utf-8')
 logic_name_var_path = os.path.join(BASE_DIR, config.get('path', 'eval_data_path'), config.get('path', 'logic_name_var_path'))
+pool_size = int(config.get('process', 'pool_size'))
+cache_data_size = int(config.get('data', 'cache_data_size'))
+cache_token_size = int(config.get('data', 'cache_token_size'))
+# 字段特征的各个缓存按相同的顺序访问，容量最小的缓存决定特征何时被淘汰，0表示不限大小
+profile_cache_size = min([size for size in [int(config.get('data', name)) for name in ['cache_text_rep_size', 'cache_text_statistics', 'cache_instance_statistics']] if size > 0], default=0)
+profile_persisted = config.get('path', 'profile_store_path') != ''
+blocking = True if config.get('parameter', 'blocking').lower() == 'true' else False
+blocking_slack = float(config.get('parameter', 'blocking_slack'))
+engine = config.get('parameter', 'engine').lower()
+if engine not in ['pairwise', 'cluster']:
+    raise Exception('engine必须为pairwise或cluster')
+field_cluster = FieldCluster(mapping_extractor, int(config.get('parameter', 'cluster_neighbours')))
+profile = True if config.get('mode', 'profile').lower() == 'true' else False
+profiler_name = config.get('mode', 'profiler').lower()
+if profiler_name not in profiler.PROFILERS:
+    raise Exception('profiler必须为{}之一'.format(', '.join(profiler.PROFILERS)))
+profile_path = os.path.dirname(os.path.join(BASE_DIR, config.get('path', 'post_result_path')))
+pair_result_db_path = config.get('path', 'pair_result_db_path')
+pair_store = PairStore(os.path.join(BASE_DIR, pair_result_db_path)) if pair_result_db_path != '' else None
+task_db = TaskDB(os.path.join(BASE_DIR, config.get('path', 'task_db_path')))
+task_db.create_table('metrics', task_id='varchar(100)', content='text', create_time='date')
+task_db.create_table('timing', task_id='varchar(100)', content='text', create_time='date')
 
 
 def clear_cache(func):
@@ -25,11 +58,64 @@ def clear_cache(func):
     def wrapper(*args, **kwargs):
         result = func(*args, **kwargs)
         mapping_extractor.clear()
+        Tokenizer.clear()
         Asset.clear()
         return result
     return wrapper
 
 
+def profile_task(func):
+    """
+    配置中profile为true或调用时指定profile=True时，在剖析器下执行任务，结果按taskId保存在post_result.json所在的目录
+    """
+    @wraps(func)
+    def wrapper(task_id, *args, profile=profile, **kwargs):
+        if not profile:
+            return func(task_id, *args, **kwargs)
+        logger.info('Profile taskId {} with {}'.format(task_id, profiler_name))
+        with profiler.profile(profile_path, 'profile_{}'.format(task_id), profiler_name):
+            return func(task_id, *args, **kwargs)
+    return wrapper
+
+
+def report_metrics(func):
+    """
+    记录任务执行期间各缓存的命中、未命中与淘汰次数及任务结束时缓存的大小，写入日志与TaskDB
+    需要在clear_cache之内，以便在清空缓存前统计
+    """
+    @wraps(func)
+    def wrapper(task_id, *args, **kwargs):
+        before = cache_metrics()
+        try:
+            return func(task_id, *args, **kwargs)
+        finally:
+            metrics = cache_metrics_delta(before, cache_metrics())
+            logger.info('Cache metrics of taskId {}: {}'.format(task_id, json.dumps(metrics, ensure_ascii=False)))
+            task_db.insert(task_id, json.dumps(metrics), get_cur_time_rep(), table='metrics')
+    return wrapper
+
+
+def report_timing(func):
+    """
+    记录任务中数据获取、分词、实例特征匹配、模型编码、稳定匹配与结果回调等阶段的耗时，按任务与表对汇总，写入日志与TaskDB
+    """
+    @wraps(func)
+    def wrapper(task_id, *args, **kwargs):
+        timer.reset()
+        start = time.perf_counter()
+        try:
+            return func(task_id, *args, **kwargs)
+        finally:
+            summary = timer.summary()
+            summary['seconds'] = round(time.perf_counter() - start, 6)
+            logger.info('Timing of taskId {}: {}'.format(task_id, json.dumps(summary['stages'], ensure_ascii=False)))
+            logger.info('Counters of taskId {}: {}'.format(task_id, json.dumps(summary['counters'], ensure_ascii=False)))
+            for item in summary['pairs']:
+                logger.info('Timing of taskId {}, tables {}: {}'.format(task_id, item['tables'], json.dumps(item['stages'], ensure_ascii=False)))
+            task_db.insert(task_id, json.dumps(summary), get_cur_time_rep(), table='timing')
+    return wrapper
+
+
 def convert_match(match):
     data = []
     for key, value in match.items():
@@ -40,44 +126,237 @@ def convert_match(match):
     return data
 
 
-# ! 以下接口没有考虑两个参数重复的情况
+def _in_worker(func):
+    """
+    在进程池的子进程中执行func，另外返回子进程中的计时与缓存次数的变化，由_imap计入当前任务
+    """
+    @wraps(func)
+    def wrapper(args):
+        timer.reset()
+        before = cache_metrics()
+        result = func(*args)
+        return result, timer.summary(), cache_metrics_delta(before, cache_metrics())
+    return wrapper
+
+
+@_in_worker
+def _profile_table(table_id):
+    return mapping_extractor.profile(table_id)
+
+
+@_in_worker
+def _match_pair(table_id_1, table_id_2):
+    return mapping_extractor.match(table_id_1, table_id_2, both=True)
+
+
+def _imap(func, items):
+    """
+    fork进程池，按items的顺序依次返回func的结果
+    celery的worker进程是守护进程，不能使用multiprocessing创建子进程，因此使用billiard
+    """
+    processes = min(pool_size, len(items))
+    pool = Pool(processes=processes)
+    try:
+        for result, summary, metrics in pool.imap(func, items, chunksize=max(1, len(items) // (processes * 4))):
+            timer.merge(summary)
+            merge_cache_metrics(metrics)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def match_pairs(pairs, both=False, use_index=False):
+    """
+    匹配所有表对，按表对的顺序合并结果；两端为同一张表的表对被去掉，(a, b)与(b, a)只匹配一次
+    use_index为true时表级的候选过滤使用近似近邻索引
+    """
+    pairs = list(dict.fromkeys((table_id_1, table_id_2) for table_id_1, table_id_2 in pairs if table_id_1 != table_id_2))
+    canonical = list(dict.fromkeys(canonical_pair(pair) for pair in pairs))
+    results = dict(zip(canonical, _match_canonical_pairs(canonical, use_index)))
+    match = defaultdict(list)
+    for table_id_1, table_id_2 in pairs:
+        for key, value in results[canonical_pair((table_id_1, table_id_2))].items():
+            if both or key[0] == table_id_1:
+                match[key].append(value)
+    return match
+
+
+def _pair_key(table_id_1, table_id_2):
+    return PairStore.key(mapping_extractor.version, table_id_1, Asset.get_table_version(table_id_1), table_id_2, Asset.get_table_version(table_id_2))
+
+
+def _match_canonical_pairs(pairs, use_index=False):
+    """
+    匹配规范化的表对，返回与pairs对齐的双向匹配结果，已保存的结果直接复用
+    pool_size大于1时先由进程池计算各表的字段特征，载入后再fork进程池匹配各表对
+    """
+    results = [{} for _ in pairs]
+    keys = [None] * len(pairs)
+    candidates = list(range(len(pairs)))
+    if blocking:
+        use_index = use_index and mapping_extractor.index_neighbours > 0
+        kept = set(mapping_extractor.index_block(pairs, blocking_slack) if use_index else mapping_extractor.block(pairs, blocking_slack))
+        candidates = [k for k in candidates if pairs[k] in kept]
+        timer.count('pair_blocked', len(pairs) - len(candidates))
+        if pair_store is not None:
+            # 被过滤的表对也记录最近一次的结果，增量匹配时才能发现之前的关系被删除
+            for k in range(len(pairs)):
+                if pairs[k] not in kept:
+                    key = PairStore.key(mapping_extractor.version, 'blocked', use_index, blocking_slack, pairs[k][0], pairs[k][1])
+                    if pair_store.get_latest_key(*pairs[k]) != key:
+                        pair_store.set_latest_key(pairs[k][0], pairs[k][1], key)
+    fields = {table_id: len(Asset.get_fields_id_by_table_id(table_id)) for k in candidates for table_id in pairs[k]}
+    # 表的数据只在字段特征被淘汰后才需要重新获取，因此按字段特征缓存的容量分块
+    order = [candidates[i] for i in scheduler.schedule([pairs[k] for k in candidates], profile_cache_size, fields)]
+    parallel = pool_size > 1 and len(candidates) > 1
+    todo = []
+    for k in order:
+        if pair_store is not None:
+            keys[k] = _pair_key(*pairs[k])
+            if pair_store.get_latest_key(*pairs[k]) != keys[k]:
+                pair_store.set_latest_key(pairs[k][0], pairs[k][1], keys[k])
+            results[k] = pair_store.get(keys[k])
+            if results[k] is not None:
+                timer.count('pair_reuse')
+                continue
+        todo.append(k)
+        if not parallel:
+            results[k] = mapping_extractor.match(pairs[k][0], pairs[k][1], both=True)
+            if pair_store is not None:
+                pair_store.put(keys[k], results[k])
+    timer.count('data_fetch_expected', _expected_fetches(pairs, order, set(todo), fields, parallel))
+    timer.count('data_fetch_unscheduled', _expected_fetches(pairs, candidates, set(todo), fields, parallel))
+    if parallel and len(todo) > 0:
+        tables = list(dict.fromkeys(table_id for k in todo for table_id in pairs[k]))
+        # 需要模型编码的部分在当前进程中完成，分词、实例特征等CPU密集的部分由子进程计算
+        for table_id in tables:
+            mapping_extractor.prepare_semantic(table_id)
+        for table_profile, table_id in zip(_imap(_profile_table, [(table_id,) for table_id in tables]), tables):
+            mapping_extractor.load(table_id, table_profile)
+        for result, k in zip(_imap(_match_pair, [pairs[k] for k in todo]), todo):
+            results[k] = result
+            if pair_store is not None:
+                pair_store.put(keys[k], result)
+    return results
+
+
+def _expected_fetches(pairs, order, matched, fields, parallel):
+    """
+    按order的顺序匹配时获取表数据的次数，与_match_canonical_pairs访问各级缓存的方式相同，matched为需要匹配而不是复用结果的表对
+    并行时每个进程池按单个子进程估计
+    """
+    model = scheduler.FetchModel(fields, cache_data_size, profile_cache_size, cache_token_size, profile_persisted)
+    todo = [k for k in order if k in matched]
+    for k in order:
+        if pair_store is not None:
+            for table_id in pairs[k]:
+                model.digest(table_id)
+        if not parallel and k in matched:
+            for table_id in pairs[k]:
+                model.match(table_id)
+    if parallel and len(todo) > 0:
+        tables = list(dict.fromkeys(table_id for k in todo for table_id in pairs[k]))
+        worker = model.fork()
+        for table_id in tables:
+            worker.match(table_id)
+        model.fetches += worker.fetches
+        for table_id in tables:
+            model.load(table_id)
+        worker = model.fork()
+        for k in todo:
+            for table_id in pairs[k]:
+                worker.match(table_id)
+        model.fetches += worker.fetches
+    return model.fetches
+
 
 @app.task
+@profile_task
 @clear_cache
+@report_metrics
+@report_timing
 def match_all_interrelation(task_id, table_id_list):
-    match = defaultdict(list)
-    for i in range(0, len(table_id_list)):
-        for j in range(i + 1, len(table_id_list)):
-            for key, value in mapping_extractor.match(table_id_list[i], table_id_list[j], both=True).items():
-                match[key].append(value)
+    Asset.prefetch_fields(table_id_list)
+    if engine == 'cluster':
+        return post_result(task_id, convert_match(field_cluster.match(table_id_list)))
+    pairs = [(table_id_list[i], table_id_list[j]) for i in range(0, len(table_id_list)) for j in range(i + 1, len(table_id_list))]
+    match = match_pairs(pairs, both=True)
     return post_result(task_id, convert_match(match))
 
 
 @app.task
+@profile_task
 @clear_cache
+@report_metrics
+@report_timing
 def match_one2all_interrelation(task_id, table_id_src, table_id_list_dest):
-    match = defaultdict(list)
-    for table_id_dest in table_id_list_dest:
-        for key, value in mapping_extractor.match(table_id_src, table_id_dest).items():
-            match[key].append(value)
+    Asset.prefetch_fields([table_id_src] + table_id_list_dest)
+    match = match_pairs([(table_id_src, table_id_dest) for table_id_dest in table_id_list_dest], use_index=True)
     return post_result(task_id, convert_match(match))
 
 
 @app.task
+@profile_task
 @clear_cache
+@report_metrics
+@report_timing
 def match_one2one_interrelation(task_id, tabld_id_src, tabld_id_dest):
-    match = defaultdict(list)
-    for key, value in mapping_extractor.match(tabld_id_src, tabld_id_dest).items():
-        match[key].append(value)
+    Asset.prefetch_fields([tabld_id_src, tabld_id_dest])
+    if tabld_id_src == tabld_id_dest:
+        # match_pairs会去掉两端为同一张表的表对，单独请求时仍返回字段到自身的映射
+        match = defaultdict(list)
+        for key, value in mapping_extractor.match(tabld_id_src, tabld_id_dest).items():
+            match[key].append(value)
+    else:
+        match = match_pairs([(tabld_id_src, tabld_id_dest)])
     return post_result(task_id, convert_match(match))
 
 
 @app.task
+@profile_task
 @clear_cache
+@report_metrics
+@report_timing
 def match_some2all_interrelation(task_id, table_id_list_src, table_id_list_dest):
-    match = defaultdict(list)
-    for table_id_src in table_id_list_src:
-        for table_id_dest in table_id_list_dest:
-            for key, value in mapping_extractor.match(table_id_src, table_id_dest).items():
-                match[key].append(value)
+    Asset.prefetch_fields(table_id_list_src + table_id_list_dest)
+    match = match_pairs([(table_id_src, table_id_dest) for table_id_src in table_id_list_src for table_id_dest in table_id_list_dest], use_index=True)
     return post_result(task_id, convert_match(match))
+
+
+@app.task
+@profile_task
+@clear_cache
+@report_metrics
+@report_timing
+def match_incremental_interrelation(task_id, table_id_list):
+    """
+    增量的所有资产相互间的关系运算，需要配置pair_result_db_path
+    两表内容版本都未变化的表对复用之前的结果，只回调关系发生变化的字段
+    """
+    if pair_store is None:
+        raise Exception('增量匹配需要配置pair_result_db_path')
+    Asset.prefetch_fields(table_id_list)
+    pairs = list(dict.fromkeys(canonical_pair((table_id_list[i], table_id_list[j])) for i in range(0, len(table_id_list)) for j in range(i + 1, len(table_id_list)) if table_id_list[i] != table_id_list[j]))
+    previous_keys = [pair_store.get_latest_key(*pair) for pair in pairs]
+    results = _match_canonical_pairs(pairs)
+    current_keys = [pair_store.get_latest_key(*pair) for pair in pairs]
+    old_match = defaultdict(list)
+    new_match = defaultdict(list)
+    changed_pairs = 0
+    for previous_key, current_key, result in zip(previous_keys, current_keys, results):
+        previous = result
+        if previous_key != current_key:
+            changed_pairs += 1
+            previous = pair_store.get(previous_key) if previous_key is not None else None
+        for key, value in (previous or {}).items():
+            old_match[key].append(value)
+        for key, value in result.items():
+            new_match[key].append(value)
+    changed = {}
+    for key in dict.fromkeys(list(new_match) + list(old_match)):
+        if set(new_match.get(key, [])) != set(old_match.get(key, [])):
+            changed[key] = new_match.get(key, [])
+    timer.count('pair_changed', changed_pairs)
+    logger.info('Incremental taskId {}: {} of {} pairs changed, {} fields changed'.format(task_id, changed_pairs, len(pairs), len(changed)))
+    return post_result(task_id, convert_match(changed))
@@ -0,0 +1,60 @@
+import json
+import logging
+
+from knowledge_fusion.utils.sqlite_store import SQLiteStore
+from knowledge_fusion.utils.utils import content_hash, get_cur_time_rep
+
+logger = logging.getLogger('database_log')
+
+
+class PairStore:
+    """
+    持久化的表对匹配结果，键由匹配器版本、两表的ID与内容版本得到，多个worker共享同一个SQLite文件
+    另外记录每个表对最近一次匹配结果的键，供增量匹配使用
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._results = SQLiteStore(path, 'pair_result', 'result')
+        with self._results.lock:
+            con = self._results.connect()
+            con.execute('create table if not exists pair_latest(table_id_1 text, table_id_2 text, key text, create_time date, primary key(table_id_1, table_id_2));')
+            con.commit()
+
+    @staticmethod
+    def key(*parts):
+        return content_hash(parts)
+
+    def get(self, key):
+        """
+        查询匹配结果，不存在时返回None
+        """
+        data = self._results.get(key)
+        if data is None:
+            return None
+        return {tuple(field_1): tuple(field_2) for field_1, field_2 in json.loads(data)}
+
+    def put(self, key, result):
+        self._results.put(key, json.dumps([[list(field_1), list(field_2)] for field_1, field_2 in result.items()], ensure_ascii=False))
+
+    def get_latest_key(self, table_id_1, table_id_2):
+        """
+        表对最近一次匹配结果的键，没有匹配过时返回None
+        """
+        with self._results.lock:
+            row = self._results.connect().execute('select key from pair_latest where table_id_1=? and table_id_2=?;', (json.dumps(table_id_1), json.dumps(table_id_2))).fetchone()
+        return None if row is None else row[0]
+
+    def set_latest_key(self, table_id_1, table_id_2, key):
+        with self._results.lock:
+            con = self._results.connect()
+            con.execute('insert or replace into pair_latest values (?, ?, ?, ?);', (json.dumps(table_id_1), json.dumps(table_id_2), key, get_cur_time_rep()))
+            con.commit()
+
+    def clear(self):
+        self._results.clear()
+        with self._results.lock:
+            con = self._results.connect()
+            con.execute('delete from pair_latest;')
+            con.commit()
+        logger.info('Clear pair results in {}'.format(self._path))
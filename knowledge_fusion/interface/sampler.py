@@ -0,0 +1,62 @@
+import numpy as np
+
+# 表数据的采样方式
+# head：取前size行，由数据接口的limit参数完成
+# reservoir：蓄水池抽样，在所有行中等概率抽取size行
+# stratified：按字段的不同值分层抽样，每个不同的值至少保留一次，其余配额按出现次数比例分配
+SAMPLE_MODES = ('none', 'head', 'reservoir', 'stratified')
+
+
+def reservoir(rows, size, rng):
+    """
+    蓄水池抽样，只遍历一次rows，返回的行保持原有的相对顺序
+    """
+    sample = Reservoir(size, rng)
+    for row in rows:
+        sample.add(row)
+    return sample.rows()
+
+
+class Reservoir:
+    """
+    逐行加入的蓄水池抽样，最多保存size行
+    """
+
+    def __init__(self, size, rng):
+        self._size = size
+        self._rng = rng
+        self._cnt = 0
+        self._sample = []
+
+    def add(self, row):
+        if self._cnt < self._size:
+            self._sample.append((self._cnt, row))
+        else:
+            j = self._rng.randint(0, self._cnt)
+            if j < self._size:
+                self._sample[j] = (self._cnt, row)
+        self._cnt += 1
+
+    def rows(self):
+        return [row for _, row in sorted(self._sample, key=lambda item: item[0])]
+
+
+def stratified(values, counts, size, rng):
+    """
+    对字典编码的字段按不同的值分层抽样，返回抽样后的values与counts，总次数为size
+    不同的值不超过size时每个值至少保留一次，否则等概率保留size个不同的值
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total <= size:
+        return values, counts
+    if len(values) >= size:
+        keep = sorted(rng.sample(range(len(values)), size))
+        return [values[i] for i in keep], np.ones(size, dtype=np.int64)
+    extra = size - len(values)
+    quota = (counts - 1) * extra / (total - len(values))
+    allocation = np.floor(quota).astype(np.int64)
+    remainder = extra - int(allocation.sum())
+    if remainder > 0:
+        allocation[np.argsort(allocation - quota, kind='stable')[:remainder]] += 1
+    return values, allocation + 1
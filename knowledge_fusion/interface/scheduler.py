@@ -0,0 +1,117 @@
+import copy
+from collections import OrderedDict
+
+
+def schedule(pairs, cache_size, weights=None):
+    """
+    按缓存大小分块安排表对的匹配顺序，返回表对在pairs中的下标
+    weights为每张表占用的缓存条目数，默认为1；cache_size为0表示缓存不限大小
+    """
+    weights = weights or {}
+    position = {}
+    for pair in pairs:
+        for table_id in pair:
+            position.setdefault(table_id, len(position))
+    # 每块的条目数不超过cache_size减去两张块外表的条目数，先匹配块内的表对，再让块外较后的表逐张与该块匹配
+    capacity = cache_size - 2 * max([weights.get(table_id, 1) for table_id in position], default=1) if cache_size > 0 else float('inf')
+    block_of = {}
+    block, used = 0, 0
+    for table_id in position:
+        weight = weights.get(table_id, 1)
+        if used > 0 and used + weight > capacity:
+            block, used = block + 1, 0
+        block_of[table_id] = block
+        used += weight
+
+    def key(k):
+        table_id_1, table_id_2 = sorted(pairs[k], key=position.get)
+        if block_of[table_id_1] == block_of[table_id_2]:
+            return block_of[table_id_1], -1, k
+        return block_of[table_id_1], position[table_id_2], k
+
+    return sorted(range(len(pairs)), key=key)
+
+
+class _LRU:
+
+    def __init__(self, size):
+        self._size = size
+        self._cache = OrderedDict()
+
+    def touch(self, key):
+        """
+        访问键，返回是否命中，未命中时写入
+        """
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return True
+        self._cache[key] = None
+        if 0 < self._size < len(self._cache):
+            self._cache.popitem(last=False)
+        return False
+
+
+class FetchModel:
+    """
+    模拟表数据、字段特征与分词结果各级缓存的命中，估计获取表数据的次数
+    只模拟条目数；persisted为true时假设特征存储开始时为空，估计值是上界
+    """
+
+    def __init__(self, fields, data_size, profile_size=0, token_size=0, persisted=False):
+        """
+        fields：每张表的字段数；各size为对应缓存的最大条目数，0表示不限大小
+        """
+        self.fetches = 0
+        self._fields = fields
+        self._persisted = persisted
+        self._data = _LRU(data_size)
+        self._profiles = _LRU(profile_size)
+        self._tokens = _LRU(token_size)
+        # 当前进程中已知数据哈希的表，与所有进程共享的已持久化特征的字段
+        self._digests = set()
+        self._stored = set()
+
+    def digest(self, table_id):
+        """
+        读取字段数据的哈希，未知时获取表数据
+        """
+        if table_id not in self._digests:
+            self._data.touch(table_id)
+            self._update_data(table_id)
+
+    def match(self, table_id):
+        """
+        匹配时读取表中所有字段的特征，特征与分词结果都未缓存时读取表数据
+        """
+        for field in range(self._fields.get(table_id, 0)):
+            key = (table_id, field)
+            if self._profiles.touch(key):
+                continue
+            if self._persisted:
+                self.digest(table_id)
+                if key in self._stored:
+                    continue
+                self._stored.add(key)
+            if not self._tokens.touch(key) and not self._data.touch(table_id):
+                self._update_data(table_id)
+
+    def load(self, table_id):
+        """
+        载入其他进程计算的字段特征
+        """
+        for field in range(self._fields.get(table_id, 0)):
+            self._profiles.touch((table_id, field))
+
+    def fork(self):
+        """
+        子进程继承当前进程的缓存，计数从0开始，持久化的特征与当前进程共享
+        """
+        stored, self._stored = self._stored, set()
+        child = copy.deepcopy(self)
+        self._stored = child._stored = stored
+        child.fetches = 0
+        return child
+
+    def _update_data(self, table_id):
+        self.fetches += 1
+        self._digests.add(table_id)
@@ -1,8 +1,8 @@
 import configparser
 import logging
-import sqlite3
 
 from knowledge_fusion.settings import config_dir
+from knowledge_fusion.utils.sqlite_store import SQLiteConnection
 
 logger = logging.getLogger('database_log')
 config = configparser.ConfigParser()
@@ -11,8 +11,7 @@ config.read(config_dir, encoding='utf-8')
 
 class TaskDB:
     def __init__(self, con_str):
-        self._con_str = con_str
-        self._con = None
+        self._connection = SQLiteConnection(con_str)
         self.new_state(ClosedTaskDB)
         self.open()
 
@@ -37,6 +36,18 @@ class TaskDB:
         """
         raise NotImplementedError()
 
+    def select_by_task_id(self, task_id, field, table='process'):
+        """
+        根据任务ID查询某个字段的值，存在多条记录时返回最新的一条
+        """
+        raise NotImplementedError()
+
+    def select_latest(self, *fields, table='process'):
+        """
+        查询最新一条记录的任务ID与指定字段
+        """
+        raise NotImplementedError()
+
     def insert(self, *args, table='process', **kwargs):
         """
         插入数据
@@ -58,6 +69,12 @@ class TaskDB:
         """
         raise NotImplementedError()
 
+    def _connect(self):
+        """
+        首次使用时才连接，连接不能跨进程共享，fork出的进程中重新连接
+        """
+        return self._connection.connect()
+
 
 class OpenTaskDB(TaskDB):
 
@@ -67,7 +84,7 @@ class OpenTaskDB(TaskDB):
     def create_table(self, table='process', **kwargs):
         try:
             logger.info('Try to create table {}'.format(table))
-            cursor = self._con.cursor()
+            cursor = self._connect().cursor()
             # 确保已创建的表格的正确性，否则会被错误使用
             sql = 'create table if not exists ' + table + '(' + 'id integer primary key autoincrement'
             sql = sql + ''.join([', ' + key + ' ' + value for key, value in kwargs.items()] + [');'])
@@ -79,7 +96,7 @@ class OpenTaskDB(TaskDB):
     def select_pid_by_task_id(self, task_id, table='process'):
         try:
             logger.info('Query pid by task_id {}'.format(task_id))
-            cursor = self._con.cursor()
+            cursor = self._connect().cursor()
             sql = "select pid from '" + table + "' where task_id='" + task_id + "';"
             cursor.execute(sql)
             r = cursor.fetchone()
@@ -88,6 +105,30 @@ class OpenTaskDB(TaskDB):
         except Exception:
             logger.error('Query pid by task_id {} failure'.format(table, task_id))
 
+    def select_by_task_id(self, task_id, field, table='process'):
+        try:
+            logger.info('Query {} by task_id {}'.format(field, task_id))
+            cursor = self._connect().cursor()
+            sql = "select " + field + " from '" + table + "' where task_id=? order by id desc;"
+            cursor.execute(sql, (task_id,))
+            r = cursor.fetchone()
+            cursor.close()
+            return None if r is None or len(r) == 0 else r[0]
+        except Exception:
+            logger.error('Query {} by task_id {} failure'.format(field, task_id))
+
+    def select_latest(self, *fields, table='process'):
+        try:
+            logger.info('Query latest {} from {}'.format(fields, table))
+            cursor = self._connect().cursor()
+            sql = "select " + ', '.join(('task_id',) + fields) + " from '" + table + "' order by id desc limit 1;"
+            cursor.execute(sql)
+            r = cursor.fetchone()
+            cursor.close()
+            return r
+        except Exception:
+            logger.error('Query latest {} from {} failure'.format(fields, table))
+
     def insert(self, *args, table='process', **kwargs):
         if len(args) != 0 and len(kwargs) == 0:
             logger.info('Insert {} to {}'.format(args, table))
@@ -103,11 +144,11 @@ class OpenTaskDB(TaskDB):
             return
         placeholder = '?, ' * (len(args) - 1) + '?'
         try:
-            cursor = self._con.cursor()
+            cursor = self._connect().cursor()
             sql = 'insert into ' + table + ' values (NULL, ' + placeholder + ');'
             cursor.execute(sql, args)
             cursor.close()
-            self._con.commit()
+            self._connect().commit()
         except Exception:
             logger.error('Insert failure. table: {}, parameter: {}'.format(table, args))
 
@@ -117,41 +158,41 @@ class OpenTaskDB(TaskDB):
         fields = ', '.join(kwargs.keys())
         placeholder = '?, ' * (len(kwargs) - 1) + '?'
         try:
-            cursor = self._con.cursor()
+            cursor = self._connect().cursor()
             sql = 'insert into ' + table + ' (' + fields + ') values (' + placeholder + ');'
             cursor.execute(sql, tuple(kwargs.values()))
             cursor.close()
-            self._con.commit()
+            self._connect().commit()
         except Exception:
             logger.error('Insert failure. table: {}, parameter: {}'.format(table, kwargs))
 
     def delete_by_task_id(self, task_id, table='process'):
         try:
             logger.info('Delete task_id {}'.format(task_id))
-            cursor = self._con.cursor()
+            cursor = self._connect().cursor()
             sql = "delete from '" + table + "' where task_id='" + task_id + "';"
             cursor.execute(sql)
             cursor.close()
-            self._con.commit()
+            self._connect().commit()
         except Exception:
             logger.error('Delete task_id {} failure'.format(task_id))
 
     def clear(self, table='process'):
         try:
             logger.info('Clear table {}'.format(table))
-            cursor = self._con.cursor()
+            cursor = self._connect().cursor()
             cursor.execute("delete from '" + table + "';")
             cursor.execute("update sqlite_sequence set seq=0 where name='" + table + "';")
             cursor.close()
-            self._con.commit()
-            self._con.execute('vacuum;')  # 返回磁盘空间
+            self._connect().commit()
+            self._connect().execute('vacuum;')  # 返回磁盘空间
         except Exception:
             logger.error('Clear table {} failure'.format(table))
 
     def close(self):
         try:
             logger.info('Close connection')
-            self._con.close()
+            self._connection.close()
         except Exception:
             logger.error('Close connection failure')
             return
@@ -161,12 +202,9 @@ class OpenTaskDB(TaskDB):
 class ClosedTaskDB(TaskDB):
 
     def open(self):
-        try:
-            logger.info('Open connection')
-            self._con = sqlite3.connect(self._con_str, check_same_thread = False)
-        except Exception:
-            logger.error('Open connection failure')
-            return
+        # 连接在首次使用时由_connect按进程建立，导入模块的父进程fork出的worker不会共享连接
+        logger.info('Open connection')
+        self._connection.close()
         self.new_state(OpenTaskDB)
 
     def create_table(self, table='process', **kwargs):
@@ -175,6 +213,12 @@ class ClosedTaskDB(TaskDB):
     def select_pid_by_task_id(self, task_id, table='process'):
         raise RuntimeError('Database not open')
 
+    def select_by_task_id(self, task_id, field, table='process'):
+        raise RuntimeError('Database not open')
+
+    def select_latest(self, *fields, table='process'):
+        raise RuntimeError('Database not open')
+
     def insert(self, *args, table='process', **kwargs):
         raise RuntimeError('Database not open')
 
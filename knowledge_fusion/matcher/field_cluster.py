@@ -0,0 +1,116 @@
+from collections import defaultdict
+
+import numpy as np
+
+from knowledge_fusion.interface.asset import Asset
+from knowledge_fusion.matcher.vector_index import IVFIndex
+from knowledge_fusion.utils import timer
+
+
+class UnionFind:
+
+    def __init__(self, size):
+        self._parent = list(range(size))
+
+    def find(self, x):
+        while self._parent[x] != x:
+            self._parent[x] = self._parent[self._parent[x]]
+            x = self._parent[x]
+        return x
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            self._parent[max(x, y)] = min(x, y)
+
+
+class FieldCluster:
+    """
+    全局字段聚类，代替逐表对的匹配，代价随字段数线性增长
+    逻辑名近邻与值重叠的字段对作为候选，分数达到阈值且互为最优的字段对用并查集合并
+    """
+
+    def __init__(self, mapping_extractor, neighbours):
+        self._mapping_extractor = mapping_extractor
+        self._neighbours = neighbours
+
+    def match(self, table_id_list):
+        """
+        返回与convert_match的输入相同格式的结果：{(表ID, 字段ID): [(表ID, 字段ID), ...]}
+        """
+        table_id_list = list(dict.fromkeys(table_id_list))
+        fields = []
+        embeddings = []
+        for table_id in table_id_list:
+            fields_id = Asset.get_fields_id_by_table_id(table_id)
+            fields.extend((table_id, field_id) for field_id in fields_id)
+            if len(fields_id) > 0:
+                embeddings.append(self._mapping_extractor.logic_name_embeddings(table_id))
+        if len(fields) == 0:
+            return defaultdict(list)
+        with timer.span('cluster'):
+            candidates = self._get_candidates(fields, np.vstack(embeddings), table_id_list)
+            edges = self._get_edges(fields, candidates)
+            union_find = UnionFind(len(fields))
+            for i, j in edges:
+                union_find.union(i, j)
+            groups = defaultdict(list)
+            for i in range(len(fields)):
+                groups[union_find.find(i)].append(i)
+            match = defaultdict(list)
+            for group in groups.values():
+                for i in group:
+                    for j in group:
+                        if fields[i][0] != fields[j][0]:
+                            match[fields[i]].append(fields[j])
+        timer.count('cluster_candidates', sum(len(value) for value in candidates.values()))
+        timer.count('cluster_edges', len(edges))
+        return match
+
+    def _get_candidates(self, fields, embeddings, table_id_list):
+        """
+        检索每个字段的近邻与值重叠的字段，按表对分组返回候选字段对在fields中的下标，表对中第一张表的字段在前
+        """
+        index = IVFIndex(nprobe=self._mapping_extractor.index_nprobe)
+        field_index = {field: i for i, field in enumerate(fields)}
+        tables = defaultdict(list)
+        for i, field in enumerate(fields):
+            tables[field[0]].append(i)
+        index.set_tables([(table_id, '', [fields[i][1] for i in rows], embeddings[rows]) for table_id, rows in tables.items()])
+        results = index.search(embeddings, self._neighbours + 1, self._mapping_extractor.candidate_bound())
+        candidates = defaultdict(set)
+        for i, row in enumerate(results):
+            for field, _ in row:
+                j = field_index[field]
+                if fields[i][0] == fields[j][0]:
+                    continue
+                a, b = min(i, j), max(i, j)
+                candidates[(fields[a][0], fields[b][0])].add((a, b))
+        for field_1, field_2 in self._mapping_extractor.overlap_candidates(table_id_list, self._neighbours):
+            a, b = sorted((field_index[field_1], field_index[field_2]))
+            candidates[(fields[a][0], fields[b][0])].add((a, b))
+        return candidates
+
+    def _get_edges(self, fields, candidates):
+        """
+        每个表对只对候选字段计算一次分数矩阵，非候选的位置不参与比较
+        分数达到阈值且同时是两个字段在对方表中的最优候选时作为一条边
+        """
+        edges = []
+        for pair in candidates.values():
+            rows = sorted(set(i for i, _ in pair))
+            cols = sorted(set(j for _, j in pair))
+            row_index = {i: r for r, i in enumerate(rows)}
+            col_index = {j: c for c, j in enumerate(cols)}
+            table_id_1, table_id_2 = fields[rows[0]][0], fields[cols[0]][0]
+            score = self._mapping_extractor.get_match_matrix(table_id_1, [fields[i][1] for i in rows], table_id_2, [fields[j][1] for j in cols])
+            masked = np.full(score.shape, -np.inf)
+            for i, j in pair:
+                masked[row_index[i], col_index[j]] = score[row_index[i], col_index[j]]
+            row_max = masked.max(axis=1)
+            col_max = masked.max(axis=0)
+            for i, j in pair:
+                s = masked[row_index[i], col_index[j]]
+                if s >= self._mapping_extractor.threshold and s == row_max[row_index[i]] and s == col_max[col_index[j]]:
+                    edges.append((i, j))
+        return edges
@@ -64,29 +64,32 @@ class DefaultType:
         return len(text.strip()) == 0
 
 
-# ! 实现有问题而蜕化为原始操作
 class Feature:
     """
     Feature父类，起两个作用：便于获取所有的Feature子类以找到所有Feature；提供公共操作
-    子类调用Feature方法前，首先判断结果是否缓存，如果是，则直接返回结果，否则缓存结果
+    FeatureHandler匹配一个数据项前通过set_words设置该数据项已有的分词结果，子类调用cut时直接返回该结果
     最后使用clear清除缓存
-    但是实现有问题，貌似在clear与其他方法调用期间，缓存被修改了，原因不明
-    因此蜕化为原始操作，这样效率会受到影响
+    缓存必须设置在Feature上而不是cls上，否则子类赋值会在子类上新建属性，clear无法将其清除，导致使用了过期的分词结果
     """
 
+    __text__ = None
     __word__ = None
 
     @classmethod
     def cut(cls, text):
-        # if cls.__word__ is None:
-        #     cls.__word__ = jieba.lcut(text)
-        # return cls.__word__
+        if Feature.__word__ is not None and Feature.__text__ == text:
+            return Feature.__word__
         return jieba.lcut(text)
 
+    @classmethod
+    def set_words(cls, text, words):
+        Feature.__text__ = text
+        Feature.__word__ = words
+
     @classmethod
     def clear(cls):
-        # cls.__word__ = None
-        pass
+        Feature.__text__ = None
+        Feature.__word__ = None
 
 
 @feature_type(type=['整数', '小数'], category=['整数'], label=['整数', '编号', '号码', '编码'], weight=1)
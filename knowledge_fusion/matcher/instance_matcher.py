@@ -6,8 +6,10 @@ import numpy as np
 
 from knowledge_fusion.interface.asset import Asset
 from knowledge_fusion.matcher.instance_feature.instance_feature import DefaultType, Feature
+from knowledge_fusion.preprocess.tokenizer import Tokenizer
 from knowledge_fusion.settings import config_dir
-from knowledge_fusion.utils.LRUDict import LRUDict
+from knowledge_fusion.utils import timer
+from knowledge_fusion.utils.LRUCache import LRUCache
 
 config = configparser.ConfigParser()
 config.read(config_dir, encoding='utf-8')
@@ -40,6 +42,10 @@ class FeatureHandler:
 
     label_list = [item for item in label_dict.keys()]
 
+    # 所有标签的向量在类加载时计算一次，Feature的匹配顺序按字段名缓存
+    label_embedding = model.encode(label_list)
+    order_dict = LRUCache(int(config.get('data', 'cache_feature_order_size')), int(config.get('data', 'cache_feature_order_bytes')), name='FeatureHandler.order_dict')
+
     category_dict = defaultdict(list)
     for feature in feature_list:
         for category in feature.category:
@@ -59,36 +65,61 @@ class FeatureHandler:
 
     def __init__(self, field):
         self._clear()
-        score_dict = {item: -1 for item in self.label_list}
-        for word in jieba.cut(field):
-            for label in self.label_list:
-                score_dict[label] = max(score_dict[label], self.model.predict_score(word, label))
-        sorted_label = sorted(zip(score_dict.values(), score_dict.keys()), reverse=True)
+        self.order = self.get_order(field)
+
+    @classmethod
+    def get_order(cls, field):
+        """
+        字段名对应的Feature匹配顺序，按字段名缓存
+        """
+        order = cls.order_dict[field]
+        if order is None:
+            order = cls._get_order(field)
+            cls.order_dict[field] = order
+        return order
+
+    @classmethod
+    def _get_order(cls, field):
+        """
+        按字段名与各文本标签的相似度从大到小确定Feature的匹配顺序
+        字段名的每个词与所有标签的相似度由一次矩阵乘法得到，标签取与各个词相似度的最大值
+        """
+        scores = np.full(len(cls.label_list), -1.0)
+        words = jieba.lcut(field)
+        if len(words) > 0:
+            scores = np.maximum(scores, cls.model.similarity_matrix(cls.model.encode(words), cls.label_embedding).max(axis=0))
+        sorted_label = sorted(zip(scores.tolist(), cls.label_list), reverse=True)
         sorted_label = list(map(lambda item: item[1], sorted_label))
-        self.order = []
+        order = []
         order_set = set()
         for label in sorted_label:
-            for feature in self.label_dict[label]:
+            for feature in cls.label_dict[label]:
                 if feature not in order_set:
                     order_set.add(feature)
-                    self.order.append(feature)
+                    order.append(feature)
+        return order
 
-    def match(self, text):
+    def match(self, text, words=None, count=1):
+        """
+        words为text已有的分词结果，提供时各Feature不再重复分词
+        count为text在字段中出现的次数，重复的值只匹配一次，结果按次数累加
+        """
         visited = set()
-        self.cnt += 1
+        self.cnt += count
         if DefaultType.match(text):
-            self.default_cnt += 1
+            self.default_cnt += count
             return
+        if words is not None:
+            Feature.set_words(text, words)
         for feature in self.order:
             visited.add(feature)
             if feature.match(text):
-                self.match_cnt += 1
-                self.type_dict[feature.type[0]] += feature.weight
+                self.match_cnt += count
+                self.type_dict[feature.type[0]] += feature.weight * count
                 for other_feature in self.category_dict[feature]:
                     if other_feature not in visited and other_feature.match(text):
-                        self.type_dict[other_feature.type[0]] += other_feature.weight
+                        self.type_dict[other_feature.type[0]] += other_feature.weight * count
                 break
-        # ! 目前该语句没什么作用
         Feature.clear()
 
     def result(self):
@@ -131,9 +162,13 @@ class InstanceMatcher:
     实例匹配器
     """
 
-    def __init__(self):
+    def __init__(self, profile_store=None):
+        """
+        profile_store：持久化的字段特征存储，为None时不使用
+        """
         super().__init__()
-        self._semantic_statistics_dict = LRUDict(int(config.get('data', 'cache_instance_statistics')))
+        self._profile_store = profile_store
+        self._semantic_statistics_dict = LRUCache(int(config.get('data', 'cache_instance_statistics')), int(config.get('data', 'cache_instance_statistics_bytes')), name='InstanceMatcher._semantic_statistics_dict')
         self._epsilon = 1e-8
 
     def get_match_score(self, table_id_1, field_id_1, table_id_2, field_id_2):
@@ -149,18 +184,67 @@ class InstanceMatcher:
         else:
             return self._cosine_similarity(vec_1, vec_2) * (2 * ratio_1 * ratio_2 / (ratio_1 + ratio_2))
 
+    def get_match_matrix(self, table_id_1, fields_id_1, table_id_2, fields_id_2):
+        """
+        一次性计算两表所有字段对的实例匹配分数，与get_match_score逐对计算的结果一致
+        """
+        statistics_1 = [self._get_statistics(table_id_1, field_id) for field_id in fields_id_1]
+        statistics_2 = [self._get_statistics(table_id_2, field_id) for field_id in fields_id_2]
+        if len(statistics_1) == 0 or len(statistics_2) == 0:
+            return np.zeros([len(statistics_1), len(statistics_2)])
+        keys = statistics_1[0][0].keys()
+        vec_1 = np.array([[type_dict[key] for key in keys] for type_dict, _ in statistics_1], dtype=np.float64)
+        vec_2 = np.array([[type_dict[key] for key in keys] for type_dict, _ in statistics_2], dtype=np.float64)
+        ratio_1 = np.array([ratio for _, ratio in statistics_1], dtype=np.float64)[:, np.newaxis]
+        ratio_2 = np.array([ratio for _, ratio in statistics_2], dtype=np.float64)[np.newaxis, :]
+        score = self._cosine_matrix(vec_1, vec_2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = score * (2 * ratio_1 * ratio_2 / (ratio_1 + ratio_2))
+        return np.where((ratio_1 == 0) | (ratio_2 == 0), 0, score)
+
+    def prepare_order(self, table_id, fields_id):
+        """
+        按字段的逻辑名确定并缓存Feature的匹配顺序，需要模型编码，在fork进程池之前计算
+        """
+        for field_id in fields_id:
+            FeatureHandler.get_order(Asset.get_field_logic_name_by_id(table_id, field_id))
+
+    def profile(self, table_id, fields_id):
+        """
+        字段的实例特征统计量，与进程无关，可以在子进程中计算后由load载入
+        """
+        return [self._get_statistics(table_id, field_id) for field_id in fields_id]
+
+    def load(self, table_id, fields_id, profiles):
+        for field_id, statistics in zip(fields_id, profiles):
+            self._semantic_statistics_dict[(table_id, field_id)] = statistics
+
     def _cosine_similarity(self, vec_1, vec_2):
         return np.dot(vec_1, vec_2) / (np.linalg.norm(vec_1) * np.linalg.norm(vec_2) + self._epsilon)
 
+    def _cosine_matrix(self, vec_1, vec_2):
+        norm_1 = np.linalg.norm(vec_1, axis=1)[:, np.newaxis]
+        norm_2 = np.linalg.norm(vec_2, axis=1)[np.newaxis, :]
+        return np.dot(vec_1, vec_2.T) / (norm_1 * norm_2 + self._epsilon)
+
     def _get_statistics(self, table_id, field_id):
         statistics = self._semantic_statistics_dict[(table_id, field_id)]
+        if statistics is not None:
+            return statistics
+        # 特征的匹配顺序由逻辑名决定，因此逻辑名也是键的一部分
+        logic_name = Asset.get_field_logic_name_by_id(table_id, field_id)
+        if self._profile_store is not None:
+            statistics = self._profile_store.get('instance_statistics', Asset.get_column_digest(table_id, field_id), logic_name)
         if statistics is None:
-            feature_handler = FeatureHandler(Asset.get_field_logic_name_by_id(table_id, field_id))
-            texts = Asset.get_data_by_id(table_id, field_id)
-            for text in texts:
-                feature_handler.match(text)
+            feature_handler = FeatureHandler(logic_name)
+            column = Tokenizer.get_column(table_id, field_id)
+            with timer.span('feature'):
+                for text, words, count in column.items():
+                    feature_handler.match(text, words, count)
             statistics = feature_handler.result()
-            self._semantic_statistics_dict[(table_id, field_id)] = statistics
+            if self._profile_store is not None:
+                self._profile_store.put('instance_statistics', [Asset.get_column_digest(table_id, field_id), logic_name], statistics)
+        self._semantic_statistics_dict[(table_id, field_id)] = statistics
         return statistics
 
     def clear(self):
@@ -1,17 +1,32 @@
 import configparser
+import logging
+import os
 
 import numpy as np
 
 from knowledge_fusion.matcher.instance_matcher import InstanceMatcher
+from knowledge_fusion.matcher.minhash import LSHIndex, MinHash
+from knowledge_fusion.matcher.profile_store import ProfileStore, matcher_version, model_version
 from knowledge_fusion.matcher.semantic_matcher import SemanticMatcher
 from knowledge_fusion.matcher.text_matcher import TextMatcher
-from knowledge_fusion.settings import config_dir
+from knowledge_fusion.matcher.vector_index import IVFIndex
+from knowledge_fusion.settings import BASE_DIR, config_dir
 from knowledge_fusion.interface.asset import Asset
+from knowledge_fusion.utils import timer
+
+logger = logging.getLogger('server_log')
 
 config = configparser.ConfigParser()
 config.read(config_dir, encoding='utf-8')
 
 
+def canonical_pair(pair):
+    """
+    表对的规范形式，两表按ID的字符串排序，(a, b)与(b, a)得到同一个表对
+    """
+    return tuple(sorted(pair, key=str))
+
+
 class MappingExtractor:
     """
     匹配抽取，建立字段的映射关系
@@ -19,26 +34,46 @@ class MappingExtractor:
     """
 
     def __init__(self):
-        self._text_matcher = TextMatcher()
+        self._profile_store = ProfileStore.open()
+        self._text_matcher = TextMatcher(self._profile_store)
         exec('from knowledge_fusion.model import model')
         self._semantic_matcher = SemanticMatcher(eval(config.get('path', 'model')))
-        self._instance_matcher = InstanceMatcher()
+        self._instance_matcher = InstanceMatcher(self._profile_store)
         self._punish = float(config.get('parameter', 'punish'))
         self._threshold = float(config.get('parameter', 'threshold'))
+        self.version = matcher_version()
+        # 单精度向量内积的误差，比较语义下界时放宽，保证不会误过滤
+        self._bound_tolerance = 1e-4
+        self.index_neighbours = int(config.get('parameter', 'index_neighbours'))
+        self.index_nprobe = int(config.get('parameter', 'index_nprobe'))
+        field_index_path = config.get('path', 'field_index_path')
+        # 索引中只有逻辑名的向量，只随模型变化，调整阈值等参数时不需要重建
+        self._field_index = IVFIndex(os.path.join(BASE_DIR, field_index_path), model_version(), self.index_nprobe) if field_index_path != '' else None
+        self._lsh_bands = int(config.get('parameter', 'lsh_bands')) if self._text_matcher.num_perm > 0 else 0
+        num_perm = self._text_matcher.num_perm
+        if not 0 <= self._lsh_bands <= num_perm:
+            raise ValueError('lsh_bands must be in [0, minhash_num_perm = {}], got {}'.format(num_perm, self._lsh_bands))
+        if self._lsh_bands > 0 and num_perm % self._lsh_bands != 0:
+            # 每段num_perm // lsh_bands个值，余下的值不参与分桶
+            logger.warning('minhash_num_perm {} is not divisible by lsh_bands {}, the last {} values of each signature are not used in LSH'.format(num_perm, self._lsh_bands, num_perm % self._lsh_bands))
+        self._overlap_threshold = float(config.get('parameter', 'overlap_threshold'))
+        self._overlap_blocking = True if config.get('parameter', 'overlap_blocking').lower() == 'true' else False
 
     def match(self, table_id_1, table_id_2, both=False):
+        with timer.pair(table_id_1, table_id_2):
+            return self._match(table_id_1, table_id_2, both)
+
+    def _match(self, table_id_1, table_id_2, both):
         fields_id_1 = Asset.get_fields_id_by_table_id(table_id_1)
         fields_id_2 = Asset.get_fields_id_by_table_id(table_id_2)
         if table_id_1 == table_id_2:
             return {(table_id_1, field_id): (table_id_1, field_id) for field_id in fields_id_1}
-        matrix = np.zeros([len(fields_id_1), len(fields_id_2)])
-        for index_1, field_id_1 in enumerate(fields_id_1):
-            for index_2, field_id_2 in enumerate(fields_id_2):
-                matrix[index_1][index_2] = self._get_match_score(table_id_1, field_id_1, table_id_2, field_id_2)
-        if len(fields_id_1) <= len(fields_id_2):
-            matching = self._marriage_matching(matrix)
-        else:
-            matching = list(map(lambda x: (x[1], x[0]), self._marriage_matching(matrix.T)))
+        matrix = self.get_match_matrix(table_id_1, fields_id_1, table_id_2, fields_id_2)
+        with timer.span('marriage'):
+            if len(fields_id_1) <= len(fields_id_2):
+                matching = self._marriage_matching(matrix)
+            else:
+                matching = list(map(lambda x: (x[1], x[0]), self._marriage_matching(matrix.T)))
         result = {}
         for i, j in matching:
             result[(table_id_1, fields_id_1[i])] = (table_id_2, fields_id_2[j])
@@ -47,6 +82,154 @@ class MappingExtractor:
                 result[(table_id_2, fields_id_2[j])] = (table_id_1, fields_id_1[i])
         return result
 
+    def prepare_semantic(self, table_id):
+        """
+        编码表中所有字段的逻辑名并确定实例特征的匹配顺序，两者都需要模型，在fork进程池之前计算
+        """
+        with timer.span('prepare'):
+            fields_id = Asset.get_fields_id_by_table_id(table_id)
+            self._semantic_matcher.prepare(table_id, fields_id)
+            self._instance_matcher.prepare_order(table_id, fields_id)
+
+    def profile(self, table_id):
+        """
+        计算表中所有字段的文本与实例特征，配置了特征存储时同时持久化，返回的结果由load载入
+        """
+        with timer.span('prepare'):
+            fields_id = Asset.get_fields_id_by_table_id(table_id)
+            return fields_id, self._text_matcher.profile(table_id, fields_id), self._instance_matcher.profile(table_id, fields_id)
+
+    def load(self, table_id, profile):
+        """
+        载入profile的结果，之后匹配该表时只需计算分数
+        """
+        fields_id, text_profiles, instance_profiles = profile
+        self._text_matcher.load(table_id, fields_id, text_profiles)
+        self._instance_matcher.load(table_id, fields_id, instance_profiles)
+
+    def semantic_bound(self, threshold=None):
+        """
+        字段对的分数达到阈值所需的最小语义相似度
+        最终分数不超过1 - (punish - 1) * (1 - sem)，达到阈值t需要sem >= 1 - (1 - t) / (punish - 1)
+        """
+        threshold = self._threshold if threshold is None else threshold
+        if self._punish <= 1:
+            return -np.inf
+        return 1 - (1 - threshold) / (self._punish - 1)
+
+    def candidate_bound(self, slack=0.0, threshold=None):
+        """
+        候选过滤使用的语义相似度下界，按单精度向量内积的误差放宽，保证slack为0时不会误过滤
+        """
+        return self.semantic_bound(threshold) + slack - self._bound_tolerance
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    def logic_name_embeddings(self, table_id):
+        """
+        表中所有字段逻辑名的单位向量，行与get_fields_id_by_table_id的字段对齐，两行的内积不小于两字段的语义分数
+        """
+        model = self._semantic_matcher.model
+        texts = [Asset.get_field_logic_name_by_id(table_id, field_id) for field_id in Asset.get_fields_id_by_table_id(table_id)]
+        return model.normalize(model.encode(texts)).astype(np.float32)
+
+    def block(self, pairs, slack=0.0, threshold=None):
+        """
+        表级的候选过滤，返回逻辑名相似度的最大值不低于candidate_bound的表对
+        slack为0时不损失召回，大于0时过滤更多表对但可能损失召回
+        """
+        bound = self.candidate_bound(slack, threshold)
+        embeddings = {}
+        result = []
+        with timer.span('blocking'):
+            for pair in pairs:
+                for table_id in pair:
+                    if table_id not in embeddings:
+                        embeddings[table_id] = self.logic_name_embeddings(table_id)
+                embeddings_1, embeddings_2 = embeddings[pair[0]], embeddings[pair[1]]
+                if len(embeddings_1) > 0 and len(embeddings_2) > 0 and np.dot(embeddings_1, embeddings_2.T).max() >= bound:
+                    result.append(pair)
+        return result
+
+    def index_block(self, pairs, slack=0.0, threshold=None):
+        """
+        基于近似近邻索引的表级候选过滤，返回有字段对出现在近邻中且逻辑名相似度不低于candidate_bound的表对
+        代价随字段数线性增长，可能损失少量召回
+        """
+        bound = self.candidate_bound(slack, threshold)
+        degree = {}
+        for pair in pairs:
+            for table_id in pair:
+                degree[table_id] = degree.get(table_id, 0) + 1
+        partners = {}
+        for table_id_1, table_id_2 in pairs:
+            if degree[table_id_2] > degree[table_id_1]:
+                table_id_1, table_id_2 = table_id_2, table_id_1
+            partners.setdefault(table_id_1, set()).add(table_id_2)
+        result = set()
+        with timer.span('blocking'):
+            index = self._update_index(list(degree))
+            for table_id, tables in partners.items():
+                for hits in index.search(self.logic_name_embeddings(table_id), self.index_neighbours, bound, tables):
+                    for (table_id_hit, _), _ in hits:
+                        result.add((table_id, table_id_hit))
+        kept = [pair for pair in pairs if pair in result or (pair[1], pair[0]) in result]
+        if self._overlap_blocking:
+            # 值重叠的表对可能不在逻辑名的近邻中，按精确的语义下界复核后保留
+            overlap = set(canonical_pair((field_1[0], field_2[0])) for field_1, field_2 in self.overlap_candidates(list(degree), self.index_neighbours))
+            missed = [pair for pair in pairs if pair not in kept and canonical_pair(pair) in overlap]
+            kept_set = set(kept + self.block(missed, slack, threshold))
+            kept = [pair for pair in pairs if pair in kept_set]
+        return kept
+
+    def overlap_candidates(self, table_id_list, neighbours):
+        """
+        按字段值的MinHash签名检索不同表之间值重叠的字段对，返回[((表ID, 字段ID), (表ID, 字段ID)), ...]
+        每个字段至多保留neighbours个，lsh_bands为0时返回空列表
+        """
+        if self._lsh_bands <= 0:
+            return []
+        fields = []
+        signatures = []
+        for table_id in table_id_list:
+            fields_id = Asset.get_fields_id_by_table_id(table_id)
+            fields.extend((table_id, field_id) for field_id in fields_id)
+            signatures.append(self._text_matcher.get_signatures(table_id, fields_id))
+        if len(fields) == 0:
+            return []
+        signatures = np.vstack(signatures)
+        result = set()
+        with timer.span('overlap'):
+            index = LSHIndex(self._text_matcher.num_perm, self._lsh_bands)
+            for i, signature in enumerate(signatures):
+                index.insert(i, signature)
+            for i, signature in enumerate(signatures):
+                hits = np.array([j for j in index.query(signature) if fields[j][0] != fields[i][0]], dtype=np.int64)
+                if len(hits) == 0:
+                    continue
+                jaccard = MinHash.jaccard_matrix(signature[np.newaxis, :], signatures[hits])[0]
+                order = np.argsort(-jaccard, kind='stable')[:neighbours]
+                for j in hits[order][jaccard[order] >= self._overlap_threshold].tolist():
+                    result.add((min(i, j), max(i, j)))
+        timer.count('overlap_candidates', len(result))
+        return [(fields[i], fields[j]) for i, j in sorted(result)]
+
+    def _update_index(self, table_id_list):
+        """
+        把表的字段逻辑名向量写入索引，逻辑名未变化的表不重新编码；未配置field_index_path时使用内存中的索引
+        """
+        index = self._field_index if self._field_index is not None else IVFIndex(nprobe=self.index_nprobe)
+        items = []
+        for table_id in table_id_list:
+            fields_id = Asset.get_fields_id_by_table_id(table_id)
+            version = IVFIndex.table_version(fields_id, [Asset.get_field_logic_name_by_id(table_id, field_id) for field_id in fields_id])
+            if index.get_version(table_id) != version:
+                items.append((table_id, version, fields_id, self.logic_name_embeddings(table_id)))
+        index.set_tables(items)
+        return index
+
     def _marriage_matching(self, matrix, return_score=False):
         size, n_col = np.shape(matrix)
         matched = np.full(size, -1, dtype=np.int32)
@@ -80,15 +263,23 @@ class MappingExtractor:
                     result.append((index, value))
         return result
 
-    def _get_match_score(self, table_id_1, field_id_1, table_id_2, field_id_2):
-        text_score = self._text_matcher.get_match_score(table_id_1, field_id_1, table_id_2, field_id_2)
-        instance_score = self._instance_matcher.get_match_score(table_id_1, field_id_1, table_id_2, field_id_2)
-        semantic_score = self._semantic_matcher.get_match_score(table_id_1, field_id_1, table_id_2, field_id_2)
+    def get_match_matrix(self, table_id_1, fields_id_1, table_id_2, fields_id_2):
+        """
+        一次性计算两表指定字段对的匹配分数矩阵
+        """
+        text_score = self._text_matcher.get_match_matrix(table_id_1, fields_id_1, table_id_2, fields_id_2)
+        instance_score = self._instance_matcher.get_match_matrix(table_id_1, fields_id_1, table_id_2, fields_id_2)
+        semantic_score = self._semantic_matcher.get_match_matrix(table_id_1, fields_id_1, table_id_2, fields_id_2)
         score = instance_score * instance_score + (1 - instance_score) * text_score
         return score - (self._punish - score) * (1 - semantic_score)
-        # score = max(self._text_matcher.get_match_score(table_id_1, field_id_1, table_id_2, field_id_2), self._instance_matcher.get_match_score(table_id_1, field_id_1, table_id_2, field_id_2))
-        # return score - (self._punish - score) * (1 - self._semantic_matcher.get_match_score(table_id_1, field_id_1, table_id_2, field_id_2))
 
     def clear(self):
         self._text_matcher.clear()
         self._instance_matcher.clear()
+
+    def clear_store(self):
+        """
+        清空持久化的字段特征
+        """
+        if self._profile_store is not None:
+            self._profile_store.clear()
@@ -0,0 +1,95 @@
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class MinHash:
+    """
+    集合的MinHash签名，两个签名相同位置取值相等的比例是两集合Jaccard相似度的无偏估计
+    元素的哈希取blake2b的前4字节，不依赖PYTHONHASHSEED，签名可以跨进程持久化与比较
+    """
+
+    def __init__(self, num_perm=128, seed=1, chunk_size=4096):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)
+        self._chunk_size = chunk_size
+
+    def signature(self, items):
+        """
+        返回长度为num_perm的uint32签名，空集合的签名所有位置都为最大值
+        """
+        items = list(items)
+        signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(items), self._chunk_size):
+            hashes = np.array([int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=4).digest(), 'little') for item in items[start:start + self._chunk_size]], dtype=np.uint64)
+            permuted = ((hashes[:, np.newaxis] * self._a + self._b) % _PRIME) & _MAX_HASH
+            signature = np.minimum(signature, permuted.min(axis=0))
+        return signature.astype(np.uint32)
+
+    @staticmethod
+    def jaccard_matrix(signatures_1, signatures_2):
+        """
+        两组签名两两之间估计的Jaccard相似度，空集合与任何集合的相似度为0
+        """
+        signatures_1 = np.asarray(signatures_1).reshape(len(signatures_1), -1)
+        signatures_2 = np.asarray(signatures_2).reshape(len(signatures_2), -1)
+        equal = np.zeros([len(signatures_1), len(signatures_2)])
+        for p in range(signatures_1.shape[1]):
+            equal += signatures_1[:, p][:, np.newaxis] == signatures_2[:, p][np.newaxis, :]
+        if signatures_1.shape[1] > 0:
+            equal /= signatures_1.shape[1]
+        empty_1 = (signatures_1 == _MAX_HASH).all(axis=1)
+        empty_2 = (signatures_2 == _MAX_HASH).all(axis=1)
+        equal[empty_1, :] = 0
+        equal[:, empty_2] = 0
+        return equal
+
+
+class LSHIndex:
+    """
+    MinHash签名的LSH分桶索引，签名分为bands段，任一段完全相同的两个签名互为候选
+    Jaccard相似度为s的两个集合成为候选的概率为1 - (1 - s ^ rows) ^ bands
+    """
+
+    def __init__(self, num_perm, bands):
+        if not 0 < bands <= num_perm:
+            raise ValueError('bands must be in (0, {}], got {}'.format(num_perm, bands))
+        self._bands = bands
+        self._rows = num_perm // bands
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+
+    @property
+    def threshold(self):
+        """
+        成为候选的概率约为一半时的Jaccard相似度
+        """
+        return (1 / self._bands) ** (1 / self._rows)
+
+    def insert(self, key, signature):
+        """
+        插入签名，空集合的签名不插入
+        """
+        if (signature == _MAX_HASH).all():
+            return
+        for band, bucket in zip(self._bands_of(signature), self._buckets):
+            bucket[band].append(key)
+
+    def query(self, signature):
+        """
+        返回与签名至少有一段相同的所有键
+        """
+        result = set()
+        if (signature == _MAX_HASH).all():
+            return result
+        for band, bucket in zip(self._bands_of(signature), self._buckets):
+            result.update(bucket.get(band, ()))
+        return result
+
+    def _bands_of(self, signature):
+        return [signature[i * self._rows:(i + 1) * self._rows].tobytes() for i in range(self._bands)]
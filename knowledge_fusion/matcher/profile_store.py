@@ -0,0 +1,106 @@
+import configparser
+import logging
+import os
+import pickle
+
+import jieba
+
+from knowledge_fusion.settings import BASE_DIR, config_dir
+from knowledge_fusion.utils.sqlite_store import SQLiteStore
+from knowledge_fusion.utils.utils import content_hash, file_version
+
+logger = logging.getLogger('database_log')
+
+config = configparser.ConfigParser()
+config.read(config_dir, encoding='utf-8')
+
+
+def _path_version(option):
+    """
+    配置中文件路径的版本，由路径与文件的大小、修改时间得到，文件内容替换后版本随之变化
+    """
+    path = config.get('path', option)
+    return [path, file_version(os.path.join(BASE_DIR, path))]
+
+
+def matcher_version():
+    """
+    匹配器的版本，影响字段特征或匹配结果的参数、词表与模型变化时版本随之变化
+    """
+    return content_hash([
+        config.get('parameter', 'num_keywords'),
+        config.get('parameter', 'punish'),
+        config.get('parameter', 'threshold'),
+        config.get('data', 'max_text_count'),
+        _path_version('idf_path'),
+        jieba.__version__,
+        model_version()
+    ])
+
+
+def model_version():
+    """
+    逻辑名编码模型的版本，模型与词向量变化时版本随之变化
+    """
+    return content_hash([
+        config.get('path', 'model'),
+        config.get('path', 'pre_sentence_transformer_model_name'),
+        _path_version('tuned_sentence_transformer_model_path'),
+        _path_version('word2vec_path')
+    ])
+
+
+def profile_version(kind):
+    """
+    字段特征的版本，只包含特征依赖的参数，调整阈值等匹配参数时已保存的特征仍然有效
+    文本特征依赖关键词数目、词表大小、idf词表与分词器；实例特征的匹配顺序由模型按逻辑名选择，另外依赖模型
+    """
+    parts = [
+        config.get('parameter', 'num_keywords'),
+        config.get('data', 'max_text_count'),
+        _path_version('idf_path'),
+        jieba.__version__
+    ]
+    if kind == 'instance_statistics':
+        parts.append(model_version())
+    return content_hash(parts)
+
+
+class ProfileStore:
+    """
+    持久化的字段特征，键由特征的种类、版本与字段数据的哈希得到，多个worker与多个任务共享同一个SQLite文件
+    逻辑名的向量由模型的EmbeddingStore持久化，不在这里保存
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._versions = {}
+        self._profiles = SQLiteStore(path, 'field_profile', 'profile', 'blob')
+
+    @classmethod
+    def open(cls):
+        """
+        按配置打开特征存储，profile_store_path为空时返回None
+        """
+        path = config.get('path', 'profile_store_path')
+        return cls(os.path.join(BASE_DIR, path)) if path != '' else None
+
+    def get(self, kind, *parts):
+        """
+        查询特征，不存在时返回None
+        """
+        data = self._profiles.get(self._key(kind, parts))
+        return None if data is None else pickle.loads(data)
+
+    def put(self, kind, parts, profile):
+        self._profiles.put(self._key(kind, parts), pickle.dumps(profile, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def clear(self):
+        self._profiles.clear()
+        logger.info('Clear field profiles in {}'.format(self._path))
+
+    def _key(self, kind, parts):
+        version = self._versions.get(kind)
+        if version is None:
+            version = self._versions[kind] = profile_version(kind)
+        return content_hash([kind, version] + list(parts))
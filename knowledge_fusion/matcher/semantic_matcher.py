@@ -16,3 +16,14 @@ class SemanticMatcher:
         text_2 = Asset.get_field_logic_name_by_id(table_id_2, field_id_2)
         score = self.model.predict_score(text_1, text_2)
         return score
+
+    def get_match_matrix(self, table_id_1, fields_id_1, table_id_2, fields_id_2):
+        texts_1 = [Asset.get_field_logic_name_by_id(table_id_1, field_id) for field_id in fields_id_1]
+        texts_2 = [Asset.get_field_logic_name_by_id(table_id_2, field_id) for field_id in fields_id_2]
+        return self.model.predict_matrix(texts_1, texts_2)
+
+    def prepare(self, table_id, fields_id):
+        """
+        编码并缓存字段的逻辑名
+        """
+        self.model.encode([Asset.get_field_logic_name_by_id(table_id, field_id) for field_id in fields_id])
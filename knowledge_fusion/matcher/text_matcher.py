@@ -2,13 +2,16 @@ import configparser
 import math
 from collections import Counter
 
-import jieba
 import numpy as np
+from scipy import sparse
 
+from knowledge_fusion.interface.asset import Asset
+from knowledge_fusion.matcher.minhash import MinHash
 from knowledge_fusion.settings import config_dir
 from knowledge_fusion.preprocess.idf_counter import IdfCounter
-from knowledge_fusion.interface.asset import Asset
-from knowledge_fusion.utils.LRUDict import LRUDict
+from knowledge_fusion.preprocess.tokenizer import Tokenizer
+from knowledge_fusion.utils import timer
+from knowledge_fusion.utils.LRUCache import LRUCache
 
 config = configparser.ConfigParser()
 config.read(config_dir, encoding='utf-8')
@@ -16,81 +19,203 @@ config.read(config_dir, encoding='utf-8')
 
 class TextMatcher:
 
-	def __init__(self):
+	def __init__(self, profile_store=None):
+		"""
+		profile_store：持久化的字段特征存储，为None时不使用
+		"""
 		super().__init__()
+		self._profile_store = profile_store
 		self._num_keywords = int(config.get('parameter', 'num_keywords'))
 		self._max_count = int(config.get('data', 'max_text_count'))
 		if self._num_keywords > self._max_count:
 			raise Exception("max_count is smaller than num_keywords")
 		self._idf_counter = IdfCounter()
-		self._text_rep_dict = LRUDict(int(config.get('data', 'cache_text_rep_size')))
-		self._text_statistics_dict = LRUDict(int(config.get('data', 'cache_text_statistics')))
+		# 全局词表，词到编号的映射，字段表示中的词都以编号保存
+		self._vocabulary = {}
+		self._text_rep_dict = LRUCache(int(config.get('data', 'cache_text_rep_size')), int(config.get('data', 'cache_text_rep_bytes')), name='TextMatcher._text_rep_dict')
+		self._text_statistics_dict = LRUCache(int(config.get('data', 'cache_text_statistics')), int(config.get('data', 'cache_text_statistics_bytes')), name='TextMatcher._text_statistics_dict')
+		self._minhash = MinHash(int(config.get('parameter', 'minhash_num_perm')))
+		self._signature_dict = LRUCache(int(config.get('data', 'cache_minhash_size')), int(config.get('data', 'cache_minhash_bytes')), name='TextMatcher._signature_dict')
 		self._epsilon = 1e-8
 
+	@property
+	def num_perm(self):
+		return self._minhash.num_perm
+
 	def get_match_score(self, table_id_1, field_id_1, table_id_2, field_id_2):
-		rep_1 = self._get_rep(table_id_1, field_id_1)
-		rep_2 = self._get_rep(table_id_2, field_id_2)
-		statistics_1 = self._get_statistics(table_id_1, field_id_1)
-		statistics_2 = self._get_statistics(table_id_2, field_id_2)
-		common_words = rep_1[1].union(rep_2[1])
-		vec_1 = np.array([rep_1[0][key] for key in common_words])
-		vec_2 = np.array([rep_2[0][key] for key in common_words])
-		score = self._cosine_similarity(vec_1, vec_2)
-		if statistics_1[2] < 1 or statistics_2[2] < 1:
-			return score
-		rep_weight = score + (1 - score) * (statistics_1[2] + statistics_2[2]) / (2 * statistics_1[2] * statistics_2[2])
-		return score * rep_weight + self._weighted_score(statistics_1, statistics_2) * (1 - rep_weight)
-
-	def _cosine_similarity(self, vec_1, vec_2):
-		return np.dot(vec_1, vec_2) / (np.linalg.norm(vec_1) * np.linalg.norm(vec_2) + self._epsilon)
+		return float(self.get_match_matrix(table_id_1, [field_id_1], table_id_2, [field_id_2])[0, 0])
+
+	def get_match_matrix(self, table_id_1, fields_id_1, table_id_2, fields_id_2):
+		"""
+		一次性计算两表所有字段对的文本匹配分数
+		两字段的词频余弦相似度只在两字段关键词的并集上计算
+		"""
+		reps_1 = [self._get_rep(table_id_1, field_id) for field_id in fields_id_1]
+		reps_2 = [self._get_rep(table_id_2, field_id) for field_id in fields_id_2]
+		statistics_1 = self._statistics_matrix(table_id_1, fields_id_1)
+		statistics_2 = self._statistics_matrix(table_id_2, fields_id_2)
+		score = self._cosine_matrix(reps_1, reps_2)
+		kind_1 = statistics_1[:, 2][:, np.newaxis]
+		kind_2 = statistics_2[:, 2][np.newaxis, :]
+		valid = (kind_1 >= 1) & (kind_2 >= 1)
+		weighted_score = np.where(valid, self._weighted_score(statistics_1, statistics_2), 0)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			rep_weight = score + (1 - score) * (kind_1 + kind_2) / (2 * kind_1 * kind_2)
+			return np.where(valid, score * rep_weight + weighted_score * (1 - rep_weight), score)
+
+	def profile(self, table_id, fields_id):
+		"""
+		字段的词频、关键词与统计量，与进程无关，可以在子进程中计算后由load载入
+		"""
+		return [(self._get_words(table_id, field_id), self._get_statistics(table_id, field_id)) for field_id in fields_id]
+
+	def load(self, table_id, fields_id, profiles):
+		"""
+		载入profile的结果，词在当前进程的词表中重新编号
+		"""
+		for field_id, (words, statistics) in zip(fields_id, profiles):
+			self._text_rep_dict[(table_id, field_id)] = self._to_rep(*words)
+			self._text_statistics_dict[(table_id, field_id)] = statistics
+
+	def get_signatures(self, table_id, fields_id):
+		"""
+		字段的MinHash签名矩阵，行与fields_id对齐
+		签名只在检索值重叠的字段时（全局字段聚类或overlap_blocking）按需计算并持久化，逐表对匹配不计算签名
+		"""
+		return np.array([self._get_signature(table_id, field_id) for field_id in fields_id], dtype=np.uint32).reshape(len(fields_id), self.num_perm)
+
+	def _cosine_matrix(self, reps_1, reps_2):
+		"""
+		所有字段对在关键词并集上的余弦相似度，一次稀疏矩阵乘法得到内积与模长中依赖对方的部分
+		"""
+		# key为关键词的词频，rest为非关键词词频的平方，mask为关键词掩码，square为关键词词频的平方和
+		# 内积为key_1·tf_2 + tf_1·key_2 - key_1·key_2，模长的平方为square_1 + rest_1·mask_2与square_2 + mask_1·rest_2
+		n = len(reps_1)
+		width = len(self._vocabulary)
+		left = self._sparse_matrix([
+			(i, [ids[key], width + ids, 2 * width + ids[key], 3 * width + ids[~key], 4 * width + ids[key]], [tf[key], tf, -tf[key], tf[~key] ** 2, np.ones(key.sum())], [0, 0, 0, n, 2 * n])
+			for i, (ids, tf, key, _) in enumerate(reps_1)
+		], 3 * n, 5 * width)
+		right = self._sparse_matrix([
+			(j, [ids, width + ids[key], 2 * width + ids[key], 3 * width + ids[key], 4 * width + ids[~key]], [tf, tf[key], tf[key], np.ones(key.sum()), tf[~key] ** 2], [0, 0, 0, 0, 0])
+			for j, (ids, tf, key, _) in enumerate(reps_2)
+		], len(reps_2), 5 * width)
+		product = (left @ right.T).toarray()
+		square_1 = np.array([rep[3] for rep in reps_1], dtype=np.float64)[:, np.newaxis]
+		square_2 = np.array([rep[3] for rep in reps_2], dtype=np.float64)[np.newaxis, :]
+		norm_1 = square_1 + product[n:2 * n]
+		norm_2 = square_2 + product[2 * n:]
+		return product[:n] / (np.sqrt(norm_1) * np.sqrt(norm_2) + self._epsilon)
+
+	@staticmethod
+	def _sparse_matrix(rows, n_row, n_col):
+		"""
+		rows中每一项为(行号, 各段的列号, 各段的值, 各段的行偏移)，拼接为CSR矩阵
+		"""
+		row_index = [np.full(len(cols), i + offset, dtype=np.int64) for i, col_list, _, offsets in rows for cols, offset in zip(col_list, offsets)]
+		col_index = [cols for _, col_list, _, _ in rows for cols in col_list]
+		data = [values for _, _, value_list, _ in rows for values in value_list]
+		if len(data) == 0:
+			return sparse.csr_matrix((n_row, n_col), dtype=np.float64)
+		return sparse.csr_matrix((np.concatenate(data).astype(np.float64), (np.concatenate(row_index), np.concatenate(col_index))), shape=(n_row, n_col))
 
 	def _approx(self, n, v):
-		return v - self._epsilon < n < v + self._epsilon
+		return (v - self._epsilon < n) & (n < v + self._epsilon)
 
 	def _get_rep(self, table_id, field_id):
+		"""
+		字段的文本表示：词在全局词表中的编号、词频、是否为关键词与关键词词频的平方和
+		持久化的特征仍以词保存，词的编号只在当前进程中有效
+		"""
 		rep = self._text_rep_dict[(table_id, field_id)]
+		if rep is None:
+			rep = self._to_rep(*self._get_words(table_id, field_id))
+			self._text_rep_dict[(table_id, field_id)] = rep
+		return rep
+
+	def _to_rep(self, words_tf, keywords):
+		ids = np.array([self._vocabulary.setdefault(word, len(self._vocabulary)) for word in words_tf], dtype=np.int64)
+		tf = np.array(list(words_tf.values()), dtype=np.float64)
+		key = np.array([word in keywords for word in words_tf], dtype=bool)
+		return ids, tf, key, float(np.dot(tf[key], tf[key]))
+
+	def _get_words(self, table_id, field_id):
+		"""
+		字段中至多max_text_count个词的词频与tf-idf最大的num_keywords个关键词
+		"""
+		rep = None
+		if self._profile_store is not None:
+			rep = self._profile_store.get('text_rep', Asset.get_column_digest(table_id, field_id))
 		if rep is None:
 			words_tf = Counter()
 			words_tf_idf = Counter()
-			texts = Asset.get_data_by_id(table_id, field_id)
-			for text in texts:
-				for word in jieba.cut(text):
-					words_tf[word.lower()] += 1  # 注意要小写化
+			column = Tokenizer.get_column(table_id, field_id)
+			for word, count in zip(column.words, column.word_counts().tolist()):
+				words_tf[word.lower()] += count  # 注意要小写化
 			for key, value in words_tf.items():
 				words_tf_idf[key] = self._idf_counter.idf_dict[key] * value
 			if len(words_tf) > self._max_count:
 				words_tf = Counter({word: words_tf[word] for word, count in words_tf_idf.most_common(self._max_count)})
 			rep = words_tf, set(word for word, count in words_tf_idf.most_common(self._num_keywords))
-			self._text_rep_dict[(table_id, field_id)] = rep
+			if self._profile_store is not None:
+				self._profile_store.put('text_rep', [Asset.get_column_digest(table_id, field_id)], rep)
 		return rep
 
+	def _get_signature(self, table_id, field_id):
+		"""
+		字段中不同的值与不同的词（均小写化）组成的集合的MinHash签名，值与词加不同的前缀区分
+		"""
+		signature = self._signature_dict[(table_id, field_id)]
+		if signature is None and self._profile_store is not None:
+			signature = self._profile_store.get('minhash', Asset.get_column_digest(table_id, field_id), self.num_perm)
+			if signature is not None:
+				self._signature_dict[(table_id, field_id)] = signature
+		if signature is None:
+			column = Tokenizer.get_column(table_id, field_id)
+			items = set('v' + str(value).lower() for value in column.values)
+			items.update('w' + word.lower() for word in column.words)
+			with timer.span('minhash'):
+				signature = self._minhash.signature(items)
+			self._signature_dict[(table_id, field_id)] = signature
+			if self._profile_store is not None:
+				self._profile_store.put('minhash', [Asset.get_column_digest(table_id, field_id), self.num_perm], signature)
+		return signature
+
+	def _statistics_matrix(self, table_id, fields_id):
+		"""
+		字段的统计量矩阵，每行为[平均长度, 长度方差, 值的种类, 词的种类]，行与fields_id对齐
+		"""
+		return np.array([self._get_statistics(table_id, field_id) for field_id in fields_id], dtype=np.float64).reshape(len(fields_id), 4)
+
 	def _get_statistics(self, table_id, field_id):
 		statistics = self._text_statistics_dict[(table_id, field_id)]
-		text_set = set()
-		word_set = set()
-		text_cnt = 0
-		word_cnt = 0
+		if statistics is None and self._profile_store is not None:
+			statistics = self._profile_store.get('text_statistics', Asset.get_column_digest(table_id, field_id))
+			if statistics is not None:
+				self._text_statistics_dict[(table_id, field_id)] = statistics
 		if statistics is None:
-			texts = Asset.get_data_by_id(table_id, field_id)
-			for text in texts:
-				text_set.add(text)
-				text_cnt += 1
-				for word in jieba.cut(text):
-					word_set.add(word)
-					word_cnt += 1
-			avg_text_len = self._avg(text_set)
-			var_text_len = self._var(text_set, avg_text_len)
-			text_kind = self._kind(text_set, text_cnt)
-			word_kind = self._kind(word_set, word_cnt)
+			column = Tokenizer.get_column(table_id, field_id)
+			text_cnt = int(column.counts.sum())
+			word_cnt = column.num_words()
+			lengths = np.fromiter(map(len, column.values), dtype=np.int64, count=len(column.values))
+			avg_text_len = self._avg(lengths)
+			var_text_len = self._var(lengths, avg_text_len)
+			text_kind = self._kind(column.values, text_cnt)
+			word_kind = self._kind(column.words, word_cnt)
 			statistics = [avg_text_len, var_text_len, text_kind, word_kind]
 			self._text_statistics_dict[(table_id, field_id)] = statistics
+			if self._profile_store is not None:
+				self._profile_store.put('text_statistics', [Asset.get_column_digest(table_id, field_id)], statistics)
 		return statistics
 
-	def _avg(self, data):
-		return sum([len(item) for item in data]) / len(data) if len(data) != 0 else 0
+	def _avg(self, lengths):
+		return int(lengths.sum()) / len(lengths) if len(lengths) != 0 else 0
 
-	def _var(self, data, avg):
-		return sum([(len(item) - avg) ** 2 for item in data]) / len(data) if len(data) != 0 else 0
+	def _var(self, lengths, avg):
+		"""
+		依次累加与逐项求和的结果相同，不使用np.sum的分块求和
+		"""
+		return float(np.cumsum((lengths - avg) ** 2)[-1]) / len(lengths) if len(lengths) != 0 else 0
 
 	def _kind(self, data, data_cnt):
 		if data_cnt in [0, 1]:
@@ -102,14 +227,30 @@ class TextMatcher:
 		return math.log2(data_cnt * len_ / (data_cnt - len_) + 1)
 		# return math.log2(data_cnt) ** (len(data) / data_cnt) * math.log2(len(data)) if data_cnt != 0 else 0
 
-	def _weighted_score(self, vec_1, vec_2):
-		sim = [min(i1, i2) / max(i1, i2) if not self._approx(max(i1, i2), 0) else 1 for i1, i2 in zip(vec_1, vec_2)]
-		min_ = min([i for i in sim if not self._approx(i, 0)])
-		weight = [1 / math.log2(i / min_ + 1) if not self._approx(i, 0) else 1 for i in sim]
-		weight_sum = sum(weight)
-		weight = [i / weight_sum for i in weight]
-		return sum([i * j for i, j in zip(sim, weight)])
+	def _weighted_score(self, statistics_1, statistics_2):
+		"""
+		所有字段对的统计量加权相似度，输入为n×4与m×4的统计量矩阵，返回n×m的矩阵
+		与逐对计算的结果只相差np.log2的舍入误差
+		"""
+		high = np.maximum(statistics_1[:, np.newaxis, :], statistics_2[np.newaxis, :, :])
+		low = np.minimum(statistics_1[:, np.newaxis, :], statistics_2[np.newaxis, :, :])
+		with np.errstate(divide='ignore', invalid='ignore'):
+			sim = np.where(self._approx(high, 0), 1.0, low / high)
+			nonzero = ~self._approx(sim, 0)
+			min_ = np.where(nonzero, sim, np.inf).min(axis=2, keepdims=True)
+			weight = np.where(nonzero, 1 / np.log2(sim / min_ + 1), 1.0)
+		weight_sum = self._sum_last(weight)
+		return self._sum_last(sim * (weight / weight_sum[:, :, np.newaxis]))
+
+	@staticmethod
+	def _sum_last(array):
+		result = np.zeros(array.shape[:-1])
+		for k in range(array.shape[-1]):
+			result = result + array[..., k]
+		return result
 
 	def clear(self):
-		self._text_rep_dict = LRUDict(int(config.get('data', 'cache_text_rep_size')))
-		self._text_statistics_dict = LRUDict(int(config.get('data', 'cache_text_statistics')))
+		self._text_rep_dict.clear()
+		self._vocabulary.clear()
+		self._text_statistics_dict.clear()
+		self._signature_dict.clear()
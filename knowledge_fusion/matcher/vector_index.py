@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from knowledge_fusion.utils.utils import content_hash, file_lock
+
+logger = logging.getLogger('server_log')
+
+
+class IVFIndex:
+    """
+    按表组织的单位向量倒排文件（IVF）近似近邻索引，向量数不足min_train时扫描所有向量，结果是精确的
+    指定path时持久化到该目录，多个worker共享，写入时加锁
+    """
+
+    def __init__(self, path=None, name='index', nprobe=8, min_train=4096):
+        self._nprobe = nprobe
+        self._min_train = min_train
+        self._tables = {}
+        self._centroids = None
+        self._trained_size = 0
+        self._dirty = True
+        self._mtime = None
+        self._dir = None
+        if path is not None:
+            self._dir = os.path.join(path, name)
+            os.makedirs(self._dir, exist_ok=True)
+            self._meta_path = os.path.join(self._dir, 'meta.json')
+            self._lock_path = os.path.join(self._dir, 'meta.lock')
+            self._refresh()
+
+    @staticmethod
+    def table_version(field_ids, texts):
+        """
+        表的向量的版本，由字段ID与编码的文本得到
+        """
+        return content_hash([[str(field_id), text] for field_id, text in zip(field_ids, texts)])
+
+    def __len__(self):
+        return sum(len(item[1]) for item in self._tables.values())
+
+    def get_version(self, table_id):
+        self._refresh()
+        item = self._tables.get(table_id)
+        return None if item is None else item[0]
+
+    def set_tables(self, items):
+        """
+        写入多张表的向量，items为(表ID, 版本, 字段ID列表, 向量矩阵)的列表，版本未变化的表忽略
+        """
+        with self._locked():
+            self._refresh()
+            changed = [item for item in items if self._tables.get(item[0], (None,))[0] != item[1]]
+            if len(changed) == 0:
+                return
+            for table_id, version, field_ids, vectors in changed:
+                vectors = np.asarray(vectors, dtype=np.float32)
+                self._tables[table_id] = (version, list(field_ids), vectors)
+                if self._dir is not None:
+                    with open(self._tmp(self._table_path(table_id)), 'wb') as file:
+                        np.savez(file, vectors=vectors, field_ids=json.dumps(list(field_ids), ensure_ascii=False))
+                    os.replace(self._tmp(self._table_path(table_id)), self._table_path(table_id))
+            size = len(self)
+            if (self._centroids is None and size >= self._min_train) or (self._centroids is not None and size >= 4 * self._trained_size):
+                self._train()
+            self._dirty = True
+            self._save_meta()
+
+    def search(self, queries, k, min_score=-np.inf, tables=None):
+        """
+        返回每个查询最相似的至多k个字段，每个结果为((表ID, 字段ID), 相似度)，按相似度从大到小排列
+        tables不为None时只在这些表中检索，相似度低于min_score的结果不返回
+        """
+        self._refresh()
+        self._rebuild()
+        queries = np.asarray(queries, dtype=np.float32)
+        if len(self._ids) == 0 or k <= 0:
+            return [[] for _ in queries]
+        allowed = None
+        if tables is not None:
+            allowed = np.zeros(len(self._table_ids), dtype=bool)
+            for table_id in tables:
+                i = self._table_index.get(table_id)
+                if i is not None:
+                    allowed[i] = True
+        results = []
+        for query in queries:
+            if self._centroids is None:
+                rows = self._all_rows
+            else:
+                nprobe = min(self._nprobe, len(self._centroids))
+                probe = np.argpartition(-np.dot(self._centroids, query), nprobe - 1)[:nprobe]
+                rows = np.concatenate([self._rows[self._starts[p]:self._starts[p + 1]] for p in probe])
+            if allowed is not None:
+                rows = rows[allowed[self._row_tables[rows]]]
+            sims = np.dot(self._vectors[rows], query)
+            if len(rows) > k:
+                top = np.argpartition(-sims, k - 1)[:k]
+                rows, sims = rows[top], sims[top]
+            order = np.argsort(-sims, kind='stable')
+            results.append([(self._ids[row], float(sim)) for row, sim in zip(rows[order].tolist(), sims[order].tolist()) if sim >= min_score])
+        return results
+
+    def _train(self, iterations=10, seed=0):
+        """
+        在至多64 * nlist个样本上训练球面k-means的聚类中心
+        """
+        vectors = np.concatenate([item[2] for item in self._tables.values() if len(item[2]) > 0])
+        nlist = max(1, int(np.sqrt(len(vectors))))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), 64 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(np.dot(sample, centroids.T), axis=1)
+            sums = np.zeros(centroids.shape, dtype=np.float64)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+        self._centroids = centroids
+        self._trained_size = len(vectors)
+        logger.info('Train IVF index. vectors: {}, nlist: {}'.format(len(vectors), nlist))
+        if self._dir is not None:
+            with open(self._tmp(self._centroids_path()), 'wb') as file:
+                np.save(file, centroids)
+            os.replace(self._tmp(self._centroids_path()), self._centroids_path())
+
+    def _rebuild(self):
+        """
+        合并所有表的向量并按聚类中心分组，得到各倒排表
+        """
+        if not self._dirty:
+            return
+        self._table_ids = list(self._tables)
+        self._table_index = {table_id: i for i, table_id in enumerate(self._table_ids)}
+        self._ids = [(table_id, field_id) for table_id, item in self._tables.items() for field_id in item[1]]
+        dimension = next((item[2].shape[1] for item in self._tables.values() if item[2].ndim == 2), 0)
+        self._vectors = np.concatenate([item[2].reshape(-1, dimension) for item in self._tables.values()]) if len(self._tables) > 0 else np.zeros([0, dimension], dtype=np.float32)
+        self._row_tables = np.repeat(np.arange(len(self._table_ids)), [len(self._tables[table_id][1]) for table_id in self._table_ids])
+        self._all_rows = np.arange(len(self._ids))
+        if self._centroids is not None:
+            assign = np.concatenate([np.argmax(np.dot(self._vectors[start:start + 65536], self._centroids.T), axis=1) for start in range(0, len(self._vectors), 65536)] or [np.zeros(0, dtype=np.int64)])
+            self._rows = np.argsort(assign, kind='stable')
+            self._starts = np.searchsorted(assign[self._rows], np.arange(len(self._centroids) + 1))
+        self._dirty = False
+
+    def _refresh(self):
+        """
+        其他进程写入后重新读取meta.json，加载版本变化的表与新的聚类中心
+        """
+        if self._dir is None or not os.path.exists(self._meta_path):
+            return
+        mtime = os.stat(self._meta_path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with open(self._meta_path, encoding='utf-8') as file:
+            meta = json.load(file)
+        tables = {}
+        for key, version in meta['tables']:
+            table_id = json.loads(key)
+            item = self._tables.get(table_id)
+            if item is None or item[0] != version:
+                with np.load(self._table_path(table_id)) as data:
+                    item = (version, json.loads(str(data['field_ids'])), data['vectors'])
+            tables[table_id] = item
+        self._tables = tables
+        self._trained_size = meta['trained_size']
+        self._centroids = np.load(self._centroids_path()) if self._trained_size > 0 else None
+        self._mtime = mtime
+        self._dirty = True
+
+    def _save_meta(self):
+        if self._dir is None:
+            return
+        meta = {'tables': [[json.dumps(table_id), item[0]] for table_id, item in self._tables.items()], 'trained_size': self._trained_size if self._centroids is not None else 0}
+        with open(self._tmp(self._meta_path), 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(self._tmp(self._meta_path), self._meta_path)
+        self._mtime = os.stat(self._meta_path).st_mtime_ns
+
+    def _locked(self):
+        return file_lock(self._lock_path if self._dir is not None else None)
+
+    def _table_path(self, table_id):
+        return os.path.join(self._dir, hashlib.md5(json.dumps(table_id).encode('utf-8')).hexdigest() + '.npz')
+
+    def _centroids_path(self):
+        return os.path.join(self._dir, 'centroids.npy')
+
+    @staticmethod
+    def _tmp(path):
+        return '{}.{}.tmp'.format(path, os.getpid())
@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from knowledge_fusion.utils.utils import file_lock
+
+logger = logging.getLogger('server_log')
+
+
+class EmbeddingStore:
+    """
+    持久化的句子向量存储，以模型标识与文本哈希为键，向量以只读内存映射的方式在所有worker之间共享
+    写入时先写向量再写.idx索引，索引中出现的行一定已经完整写入
+    """
+
+    def __init__(self, path, model_id, dimension):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        name = hashlib.md5('{}:{}'.format(model_id, dimension).encode('utf-8')).hexdigest()
+        self._vec_path = os.path.join(path, name + '.vec')
+        self._idx_path = os.path.join(path, name + '.idx')
+        self._lock_path = os.path.join(path, name + '.lock')
+        self._dimension = dimension
+        self._row_bytes = dimension * 4
+        self._index = {}
+        self._rows = 0
+        self._matrix = None
+        self._refresh()
+
+    @staticmethod
+    def key(text):
+        return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def get(self, texts):
+        """
+        查询一组文本的向量，不存在的文本对应None
+        """
+        self._refresh()
+        result = []
+        for text in texts:
+            row = self._index.get(self.key(text))
+            result.append(None if row is None else np.array(self._matrix[row]))
+        return result
+
+    def put(self, texts, embeddings):
+        """
+        追加写入一组文本的向量，已存在的文本忽略
+        """
+        with file_lock(self._lock_path):
+            try:
+                self._refresh()
+                keys = []
+                rows = []
+                for text, embedding in zip(texts, embeddings):
+                    key = self.key(text)
+                    if key not in self._index and key not in keys:
+                        keys.append(key)
+                        rows.append(embedding)
+                if len(keys) == 0:
+                    return
+                with open(self._vec_path, 'ab') as file:
+                    # 丢弃上一次写入中断时没有写入索引的向量
+                    file.truncate(self._rows * self._row_bytes)
+                    file.write(np.asarray(rows, dtype='<f4').reshape(len(keys), self._dimension).tobytes())
+                with open(self._idx_path, 'ab') as file:
+                    # 丢弃上一次写入中断时不完整的键，保证之后的键按8字节对齐
+                    file.truncate(self._rows * 8)
+                    file.write(np.asarray(keys, dtype='<u8').tobytes())
+                self._refresh()
+            except OSError:
+                logger.error('Write embedding store {} failure'.format(self._vec_path))
+
+    def __len__(self):
+        return self._rows
+
+    def _refresh(self):
+        """
+        其他进程追加写入后，读取新增的索引并重新映射向量文件
+        """
+        if not os.path.exists(self._idx_path):
+            return
+        rows = os.path.getsize(self._idx_path) // 8
+        if rows <= self._rows:
+            return
+        keys = np.fromfile(self._idx_path, dtype='<u8', count=rows - self._rows, offset=self._rows * 8)
+        for i, key in enumerate(keys.tolist(), self._rows):
+            self._index.setdefault(key, i)
+        self._rows = rows
+        self._matrix = np.memmap(self._vec_path, dtype='<f4', mode='r', shape=(rows, self._dimension))
@@ -8,9 +8,11 @@ import numpy as np
 from gensim.models import KeyedVectors
 from sentence_transformers import SentenceTransformer, util
 
+from knowledge_fusion.model.embedding_store import EmbeddingStore
 from knowledge_fusion.settings import BASE_DIR
 from knowledge_fusion.preprocess.idf_counter import IdfCounter
-from knowledge_fusion.utils.LRUDict import LRUDict
+from knowledge_fusion.utils import timer
+from knowledge_fusion.utils.LRUCache import LRUCache
 from knowledge_fusion.utils.utils import Singleton
 
 config = configparser.ConfigParser()
@@ -20,16 +22,81 @@ config.read(os.path.join(BASE_DIR, 'config.ini'), encoding='utf-8')
 class Model(metaclass=Singleton):
     """
     用于语义相似度计算的模型
-    使用LRU字典缓存最近访问数据
+    使用LRU缓存最近访问数据，未命中时再查询持久化的向量存储，最后才调用模型编码
     对于调用者屏蔽访问细节
     """
 
     def __init__(self):
-        self._sentence_score_dict = LRUDict(int(config.get('data', 'cache_embedding_size')))
+        self._sentence_score_dict = LRUCache(int(config.get('data', 'cache_embedding_size')), int(config.get('data', 'cache_embedding_bytes')), name='Model._sentence_score_dict')
+        self._batch_size = int(config.get('data', 'encode_batch_size'))
+        self._embedding_store = None
 
     def predict_score(self, sen1, sen2):
         raise NotImplementedError()
 
+    def predict_matrix(self, sens1, sens2):
+        """
+        计算两组句子两两之间的相似度矩阵
+        两组句子合并后只调用一次encode，再由归一化后的矩阵乘法得到相似度
+        """
+        embeddings = self.encode(list(sens1) + list(sens2))
+        return self.similarity_matrix(embeddings[:len(sens1)], embeddings[len(sens1):])
+
+    def encode(self, sens):
+        """
+        获取一组句子的向量，返回行与sens对齐的矩阵
+        未缓存的句子去重后先查询向量存储，仍不存在的句子一次性交给_encode批量编码并写回向量存储
+        """
+        embeddings = [self._sentence_score_dict[sen] for sen in sens]
+        missing = list(dict.fromkeys(sen for sen, embedding in zip(sens, embeddings) if embedding is None))
+        if len(missing) > 0:
+            encoded = {}
+            if self._embedding_store is not None:
+                encoded = {sen: embedding for sen, embedding in zip(missing, self._embedding_store.get(missing)) if embedding is not None}
+            unknown = [sen for sen in missing if sen not in encoded]
+            if len(unknown) > 0:
+                with timer.span('encode'):
+                    embedding_unknown = self._encode(unknown)
+                encoded.update(zip(unknown, embedding_unknown))
+                if self._embedding_store is not None:
+                    self._embedding_store.put(unknown, embedding_unknown)
+            for sen, embedding in encoded.items():
+                self._sentence_score_dict[sen] = embedding
+            embeddings = [encoded[sen] if embedding is None else embedding for sen, embedding in zip(sens, embeddings)]
+        if len(embeddings) == 0:
+            return np.zeros([0, self._dimension()])
+        return np.array(embeddings)
+
+    def similarity_matrix(self, embeddings1, embeddings2):
+        """
+        两组向量两两之间的余弦相似度
+        """
+        return np.dot(self.normalize(embeddings1), self.normalize(embeddings2).T)
+
+    def normalize(self, embeddings):
+        """
+        将向量按行归一化为单位向量，单位向量的内积即余弦相似度，不小于similarity_matrix的结果
+        """
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def _encode(self, sens):
+        """
+        对一组未缓存的句子编码，返回行与sens对齐的矩阵
+        """
+        raise NotImplementedError()
+
+    def _dimension(self):
+        raise NotImplementedError()
+
+    def _open_embedding_store(self, model_id):
+        """
+        打开该模型的持久化向量存储，未配置路径时不使用
+        """
+        path = config.get('path', 'embedding_store_path').strip()
+        if len(path) == 0:
+            return None
+        return EmbeddingStore(os.path.join(BASE_DIR, path), model_id, self._dimension())
+
     def clear(self):
         self._sentence_score_dict.clear()
 
@@ -41,29 +108,33 @@ class Word2VecModel(Model):
         self.word2vec = KeyedVectors.load_word2vec_format(os.path.join(BASE_DIR, config.get('path', 'word2vec_path')))
         self._idf_counter = IdfCounter()
         self.epsilon = 1e-7
+        self._embedding_store = self._open_embedding_store('word2vec:' + config.get('path', 'word2vec_path'))
 
     def predict_score(self, sen1, sen2):
-        embedding1, embedding2 = self._sentence_score_dict[sen1], self._sentence_score_dict[sen2]
-        if embedding1 is None:
-            words1 = jieba.lcut(sen1)
-            word_count1 = Counter(words1)
-            weight1 = [self._idf_counter.idf_dict[key] * value for key, value in word_count1.items()]
-            embedding1 = np.zeros(self.word2vec.vector_size)
-            for word, w in zip(words1, weight1):
-                if word in self.word2vec.vocab:
-                    embedding1 += self.word2vec.get_vector(word) * w
-            self._sentence_score_dict[sen1] = embedding1
-        if embedding2 is None:
-            words2 = jieba.lcut(sen2)
-            word_count2 = Counter(words2)
-            weight2 = [self._idf_counter.idf_dict[key] * value for key, value in word_count2.items()]
-            embedding2 = np.zeros(self.word2vec.vector_size)
-            for word, w in zip(words2, weight2):
-                if word in self.word2vec.vocab:
-                    embedding2 += self.word2vec.get_vector(word) * w
-            self._sentence_score_dict[sen2] = embedding2
+        embedding1, embedding2 = self.encode([sen1, sen2])
         return self._cosine_similarity(embedding1, embedding2)
 
+    def similarity_matrix(self, embeddings1, embeddings2):
+        norm1 = np.linalg.norm(embeddings1, axis=1)[:, np.newaxis]
+        norm2 = np.linalg.norm(embeddings2, axis=1)[np.newaxis, :]
+        return np.dot(embeddings1, embeddings2.T) / (norm1 * norm2 + self.epsilon)
+
+    def _encode(self, sens):
+        return np.array([self._embed(sen) for sen in sens])
+
+    def _embed(self, sen):
+        words = jieba.lcut(sen)
+        word_count = Counter(words)
+        weight = [self._idf_counter.idf_dict[key] * value for key, value in word_count.items()]
+        embedding = np.zeros(self.word2vec.vector_size)
+        for word, w in zip(words, weight):
+            if word in self.word2vec.vocab:
+                embedding += self.word2vec.get_vector(word) * w
+        return embedding
+
+    def _dimension(self):
+        return self.word2vec.vector_size
+
     def _cosine_similarity(self, vec1, vec2):
         return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2) + self.epsilon)
 
@@ -73,13 +144,14 @@ class SentenceTransformerModel(Model):
     def __init__(self):
         super().__init__()
         self.model = SentenceTransformer(os.path.join(BASE_DIR, config.get('path', 'tuned_sentence_transformer_model_path')))
+        self._embedding_store = self._open_embedding_store('sentence_transformer:' + config.get('path', 'tuned_sentence_transformer_model_path'))
 
     def predict_score(self, sen1, sen2):
-        embedding1, embedding2 = self._sentence_score_dict[sen1], self._sentence_score_dict[sen2]
-        if embedding1 is None:
-            embedding1 = self.model.encode([sen1], convert_to_tensor=False)
-            self._sentence_score_dict[sen1] = embedding1
-        if embedding2 is None:
-            embedding2 = self.model.encode([sen2], convert_to_tensor=False)
-            self._sentence_score_dict[sen2] = embedding2
+        embedding1, embedding2 = self.encode([sen1, sen2])
         return util.pytorch_cos_sim(embedding1, embedding2)[0][0]
+
+    def _encode(self, sens):
+        return self.model.encode(sens, batch_size=self._batch_size, convert_to_numpy=True)
+
+    def _dimension(self):
+        return self.model.get_sentence_embedding_dimension()
@@ -0,0 +1,86 @@
+import configparser
+
+import jieba
+import numpy as np
+
+from knowledge_fusion.interface.asset import Asset
+from knowledge_fusion.settings import config_dir
+from knowledge_fusion.utils import timer
+from knowledge_fusion.utils.LRUCache import LRUCache
+
+config = configparser.ConfigParser()
+config.read(config_dir, encoding='utf-8')
+
+
+class TokenizedColumn:
+    """
+    一个字段的分词结果，每个不同的值只分词一次
+    words为不同的词，第i个值的词编号为codes[offsets[i]:offsets[i + 1]]
+    """
+
+    __slots__ = ('values', 'counts', 'words', 'codes', 'offsets')
+
+    def __init__(self, values, counts):
+        self.values = values
+        self.counts = np.array(counts, dtype=np.int64)
+        word_index = {}
+        codes = []
+        offsets = [0]
+        for value in values:
+            for word in jieba.cut(value):
+                code = word_index.get(word)
+                if code is None:
+                    code = word_index[word] = len(word_index)
+                codes.append(code)
+            offsets.append(len(codes))
+        self.words = list(word_index)
+        self.codes = np.array(codes, dtype=np.int32)
+        self.offsets = np.array(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.values)
+
+    def tokens(self, i):
+        return [self.words[code] for code in self.codes[self.offsets[i]:self.offsets[i + 1]].tolist()]
+
+    def items(self):
+        """
+        依次返回每个不同的值、其分词结果与出现次数
+        """
+        for i, (value, count) in enumerate(zip(self.values, self.counts.tolist())):
+            yield value, self.tokens(i), count
+
+    def word_counts(self):
+        """
+        每个词在字段所有数据中出现的总次数，与words对齐
+        """
+        weights = np.repeat(self.counts, np.diff(self.offsets))
+        return np.bincount(self.codes, weights=weights, minlength=len(self.words)).astype(np.int64)
+
+    def num_words(self):
+        """
+        字段所有数据分词后词的总数
+        """
+        return int(np.dot(self.counts, np.diff(self.offsets)))
+
+
+class Tokenizer:
+    """
+    按字段缓存分词结果，文本匹配与实例匹配共用同一份结果，每个不同的值只调用一次jieba
+    """
+
+    column_dict = LRUCache(int(config.get('data', 'cache_token_size')), int(config.get('data', 'cache_token_bytes')), name='Tokenizer.column_dict')
+
+    @classmethod
+    def get_column(cls, table_id, field_id):
+        column = cls.column_dict[(table_id, field_id)]
+        if column is None:
+            data = Asset.get_column_by_id(table_id, field_id)
+            with timer.span('segment'):
+                column = TokenizedColumn(data.values, data.counts)
+            cls.column_dict[(table_id, field_id)] = column
+        return column
+
+    @classmethod
+    def clear(cls):
+        cls.column_dict.clear()
@@ -180,7 +180,7 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False
         },
-        # ! 这个log貌似没有用到
+        # 匹配任务的缓存统计与各阶段耗时
         'match_log': {
             'handlers': ['console', 'matchHandler'],
             'level': 'DEBUG',
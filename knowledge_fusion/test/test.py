@@ -2,14 +2,18 @@ import configparser
 import logging
 import operator
 import os
+import time
 from collections import defaultdict
 
 import numpy as np
 
-from knowledge_fusion.interface.asset import Asset
+from knowledge_fusion.interface.asset import Asset, sample_mode, sample_size
 from knowledge_fusion.matcher.mapping_extractor import MappingExtractor
+from knowledge_fusion.settings import config_dir
 
 logging.getLogger().setLevel(logging.WARNING)
+config = configparser.ConfigParser()
+config.read(config_dir, encoding='utf-8')
 eval_data_path = 'data'
 eval_result_path = os.path.join('data', 'result.txt')
 
@@ -22,6 +26,8 @@ class Test:
 	all_match = defaultdict(set)
 	len_match = 0
 	weights = [i / 100 for i in range(101, 501)]
+	blocking_slacks = [-0.1, 0, 0.1, 0.2, 0.3, 0.4, 0.5]
+	index_neighbours = [10, 20, 50, 100, 200]
 	mapping_extractor = MappingExtractor()
 	mapping_extractor._threshold = 0
 
@@ -32,6 +38,8 @@ class Test:
 		best_F1 = 0
 		best_F1_p = 0
 		best_F1_r = 0
+		with open(eval_result_path, 'a', encoding='utf-8') as file:
+			file.write('sample_mode: {}, sample_size: {}\n'.format(sample_mode, sample_size))
 		logging.info('Get all match score')
 		all_match_score = cls.get_all_match_score()
 		logging.info('Measure performance under different weights')
@@ -65,6 +73,47 @@ class Test:
 			file.write(
 				'best_weight: {}, best_threshold: {}, best_F1: {}, precision: {}, recall: {}\n'.format(best_weight, best_t, best_F1, best_F1_p, best_F1_r))
 
+	@classmethod
+	def test_blocking(cls):
+		"""
+		评估表级候选过滤：不同blocking_slack下保留的表对数目与真实匹配的字段对所在表对被保留的比例，即过滤后召回率的上限
+		"""
+		threshold = float(config.get('parameter', 'threshold'))
+		pairs = [(cls.table_id_list[i], cls.table_id_list[j]) for i in range(0, len(cls.table_id_list)) for j in range(i + 1, len(cls.table_id_list))]
+		for slack in cls.blocking_slacks:
+			start = time.time()
+			kept = set(cls.mapping_extractor.block(pairs, slack, threshold))
+			m = 0
+			for key, value in cls.all_match.items():
+				for v in value:
+					if (key[0], v[0]) in kept or (v[0], key[0]) in kept:
+						m += 1
+			line = 'blocking_slack: {}, pairs: {}/{}, recall: {}, time: {}\n'.format(slack, len(kept), len(pairs), m / cls.len_match, time.time() - start)
+			logging.info(line)
+			with open(eval_result_path, 'a', encoding='utf-8') as file:
+				file.write(line)
+
+	@classmethod
+	def test_index_blocking(cls):
+		"""
+		评估基于近似近邻索引的表级候选过滤：不同index_neighbours下保留的表对数目与召回率的上限，与精确的过滤（blocking_slack为0）对比
+		"""
+		threshold = float(config.get('parameter', 'threshold'))
+		pairs = [(cls.table_id_list[i], cls.table_id_list[j]) for i in range(0, len(cls.table_id_list)) for j in range(i + 1, len(cls.table_id_list))]
+		for neighbours in cls.index_neighbours:
+			start = time.time()
+			cls.mapping_extractor.index_neighbours = neighbours
+			kept = set(cls.mapping_extractor.index_block(pairs, 0, threshold))
+			m = 0
+			for key, value in cls.all_match.items():
+				for v in value:
+					if (key[0], v[0]) in kept or (v[0], key[0]) in kept:
+						m += 1
+			line = 'index_neighbours: {}, pairs: {}/{}, recall: {}, time: {}\n'.format(neighbours, len(kept), len(pairs), m / cls.len_match, time.time() - start)
+			logging.info(line)
+			with open(eval_result_path, 'a', encoding='utf-8') as file:
+				file.write(line)
+
 	@classmethod
 	def measure(cls, all_weighted_score):
 		sorted_score = sorted(all_weighted_score.items(), key=operator.itemgetter(1), reverse=True)
@@ -129,14 +178,10 @@ class Test:
 	def convert_to_matrix(cls, table_id_1, table_id_2):
 		fields_id_1 = Asset.get_fields_id_by_table_id(table_id_1)
 		fields_id_2 = Asset.get_fields_id_by_table_id(table_id_2)
-		m_data = np.zeros([len(fields_id_1), len(fields_id_2)])
-		m_fields = np.zeros([len(fields_id_1), len(fields_id_2)])
-		for index_1, item_1 in enumerate(fields_id_1):
-			for index_2, item_2 in enumerate(fields_id_2):
-				text_score = cls.mapping_extractor._text_matcher.get_match_score(table_id_1, item_1, table_id_2, item_2)
-				instance_score = cls.mapping_extractor._instance_matcher.get_match_score(table_id_1, item_1, table_id_2, item_2)
-				m_data[index_1][index_2] = instance_score * instance_score + (1 - instance_score) * text_score
-				m_fields[index_1, index_2] = cls.mapping_extractor._semantic_matcher.get_match_score(table_id_1, item_1, table_id_2, item_2)
+		text_score = cls.mapping_extractor._text_matcher.get_match_matrix(table_id_1, fields_id_1, table_id_2, fields_id_2)
+		instance_score = cls.mapping_extractor._instance_matcher.get_match_matrix(table_id_1, fields_id_1, table_id_2, fields_id_2)
+		m_data = instance_score * instance_score + (1 - instance_score) * text_score
+		m_fields = cls.mapping_extractor._semantic_matcher.get_match_matrix(table_id_1, fields_id_1, table_id_2, fields_id_2)
 		return (m_data, m_fields), (fields_id_1, fields_id_2)
 
 	@classmethod
@@ -151,4 +196,6 @@ if __name__ == '__main__':
 		for file in files:
 			Test.table_id_list.append(file.split('.')[0])
 	Test.set_all_match()
+	Test.test_blocking()
+	Test.test_index_blocking()
 	Test.test()
\ No newline at end of file
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from knowledge_fusion.interface.json_stream import JsonStream
+
+body = json.dumps({'message': 'SUCCESS', 'data': {'fieldName': ['a', 'b'], 'assetData': [[1, 'x'], [2, 'y'], [3, 'z']]}}).encode('utf-8')
+
+
+def chunked(data, size):
+	return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, len(body)])
+def test_parse(size):
+	rows = []
+	result = JsonStream(chunked(body, size), ('data', 'assetData'), rows.append).parse()
+	assert rows == [[1, 'x'], [2, 'y'], [3, 'z']]
+	assert result == {'message': 'SUCCESS', 'data': {'fieldName': ['a', 'b']}}
+
+
+@pytest.mark.parametrize('end', [len(body) - 1, len(body) - 2, body.index(b'assetData') + 20, body.index(b'fieldName'), 1])
+def test_truncated(end):
+	"""
+	响应在任意位置被截断时抛出解析错误
+	"""
+	with pytest.raises(ValueError) as info:
+		JsonStream(chunked(body[:end], 7), ('data', 'assetData'), lambda row: None).parse()
+	assert 'format string' not in str(info.value)
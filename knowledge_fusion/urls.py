@@ -21,9 +21,11 @@ from knowledge_fusion.interface import api
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('test_api/', api.test_api, name='test_api'),
+    path('cache_metrics/', api.cache_metrics, name='cache_metrics'),
     path('task_state/', api.task_state, name='task_state'),
     path('delete_cache', api.delete_cache, name='delete_cache'),
     path('all_interrelation/', api.all_interrelation, name='all_interrelation'),
+    path('incremental_interrelation/', api.incremental_interrelation, name='incremental_interrelation'),
     path('one2all_interrelation/', api.one2all_interrelation, name='one2all_interrelation'),
     path('one2one_interrelation/', api.one2one_interrelation, name='one2one_interrelation'),
     path('some2all_interrelation/', api.some2all_interrelation, name='some2all_interrelation'),
@@ -0,0 +1,143 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from knowledge_fusion.utils import metrics
+
+# 估计大容器的大小时只抽样前_sample_len个元素
+_sample_len = 1000
+
+
+def sizeof(obj, seen=None):
+	"""
+	估计对象占用的字节数，递归计算容器、numpy数组与带__slots__或__dict__的对象
+	元素很多的容器只抽样部分元素再按比例放大
+	"""
+	if seen is None:
+		seen = set()
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+	if isinstance(obj, np.ndarray):
+		return sys.getsizeof(obj) + (0 if obj.base is None else obj.nbytes)
+	size = sys.getsizeof(obj)
+	if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+		return size
+	if isinstance(obj, dict):
+		items = obj.items()
+		len_ = len(obj)
+		sample = [sizeof(key, seen) + sizeof(value, seen) for key, value in _head(items)]
+	elif isinstance(obj, (list, tuple, set, frozenset)):
+		len_ = len(obj)
+		sample = [sizeof(item, seen) for item in _head(obj)]
+	else:
+		len_ = 0
+		sample = []
+		if hasattr(obj, '__dict__'):
+			size += sizeof(obj.__dict__, seen)
+		for slot in getattr(type(obj), '__slots__', ()):
+			if hasattr(obj, slot):
+				size += sizeof(getattr(obj, slot), seen)
+	if len(sample) > 0:
+		size += sum(sample) * len_ // len(sample)
+	return size
+
+
+def _head(items):
+	for i, item in enumerate(items):
+		if i == _sample_len:
+			break
+		yield item
+
+
+class LRUCache:
+	"""
+	线程安全的LRU缓存，max_len、max_bytes与ttl为0时不做对应的限制，总是保留最新写入的条目
+	缓存的值在写入时估计大小，写入后不应再修改；指定name时注册到metrics
+	"""
+
+	def __init__(self, max_len=0, max_bytes=0, ttl=0, name=None):
+		self._max_len = max_len
+		self._max_bytes = max_bytes
+		self._ttl = ttl
+		self._lock = threading.RLock()
+		self._cache = OrderedDict()
+		self._bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		if name is not None:
+			metrics.register_cache(name, self)
+
+	def __getitem__(self, key):
+		with self._lock:
+			item = self._cache.get(key)
+			if item is None:
+				self.misses += 1
+				return None
+			value, size, expire = item
+			if expire is not None and expire < time.monotonic():
+				self._remove(key)
+				self.evictions += 1
+				self.misses += 1
+				return None
+			self._cache.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def __setitem__(self, key, value):
+		size = sizeof(value)
+		expire = time.monotonic() + self._ttl if self._ttl > 0 else None
+		with self._lock:
+			if key in self._cache:
+				self._remove(key)
+			self._cache[key] = (value, size, expire)
+			self._bytes += size
+			while len(self._cache) > 1 and ((0 < self._max_len < len(self._cache)) or (0 < self._max_bytes < self._bytes)):
+				self._remove(next(iter(self._cache)))
+				self.evictions += 1
+
+	def __contains__(self, key):
+		with self._lock:
+			return key in self._cache
+
+	def __len__(self):
+		with self._lock:
+			return len(self._cache)
+
+	def __repr__(self):
+		with self._lock:
+			return {key: item[0] for key, item in self._cache.items()}.__repr__()
+
+	def __str__(self):
+		return self.__repr__()
+
+	def pop(self, key):
+		with self._lock:
+			if key not in self._cache:
+				return None
+			return self._remove(key)
+
+	def keys(self):
+		with self._lock:
+			return list(self._cache.keys())
+
+	def nbytes(self):
+		"""
+		所有条目估计的总字节数
+		"""
+		with self._lock:
+			return self._bytes
+
+	def clear(self):
+		with self._lock:
+			self._cache.clear()
+			self._bytes = 0
+
+	def _remove(self, key):
+		value, size, _ = self._cache.pop(key)
+		self._bytes -= size
+		return value
@@ -0,0 +1,69 @@
+import threading
+
+_lock = threading.Lock()
+_caches = {}
+# 由merge_cache_metrics计入的其他进程的计数，name -> {'hits', 'misses', 'evictions'}
+_merged = {}
+
+
+def register_cache(name, cache):
+	"""
+	注册缓存，同名的缓存以最后注册的为准
+	"""
+	with _lock:
+		_caches[name] = cache
+
+
+def cache_metrics():
+	"""
+	当前进程所有已注册缓存的命中、未命中、淘汰次数，条目数与估计的字节数
+	次数包含由merge_cache_metrics计入的其他进程的次数
+	"""
+	with _lock:
+		caches = list(_caches.items())
+		merged = {name: dict(item) for name, item in _merged.items()}
+	result = {}
+	for name, cache in caches:
+		extra = merged.get(name, {})
+		hits, misses = cache.hits + extra.get('hits', 0), cache.misses + extra.get('misses', 0)
+		result[name] = {
+			'hits': hits,
+			'misses': misses,
+			'hit_rate': hits / (hits + misses) if hits + misses != 0 else 0,
+			'evictions': cache.evictions + extra.get('evictions', 0),
+			'entries': len(cache),
+			'bytes': cache.nbytes()
+		}
+	return result
+
+
+def merge_cache_metrics(delta):
+	"""
+	将其他进程的cache_metrics_delta计入当前进程的次数，例如进程池中子进程的缓存命中
+	条目数与字节数只反映当前进程的缓存
+	"""
+	with _lock:
+		for name, metrics in delta.items():
+			item = _merged.setdefault(name, {'hits': 0, 'misses': 0, 'evictions': 0})
+			for key in item:
+				item[key] += metrics[key]
+
+
+def cache_metrics_delta(before, after):
+	"""
+	两次cache_metrics之间的变化，计数取差值，条目数与字节数取后一次的值
+	"""
+	result = {}
+	for name, metrics in after.items():
+		base = before.get(name, {})
+		hits = metrics['hits'] - base.get('hits', 0)
+		misses = metrics['misses'] - base.get('misses', 0)
+		result[name] = {
+			'hits': hits,
+			'misses': misses,
+			'hit_rate': hits / (hits + misses) if hits + misses != 0 else 0,
+			'evictions': metrics['evictions'] - base.get('evictions', 0),
+			'entries': metrics['entries'],
+			'bytes': metrics['bytes']
+		}
+	return result
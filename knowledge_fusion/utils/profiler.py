@@ -0,0 +1,51 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+from contextlib import contextmanager
+
+logger = logging.getLogger('match_log')
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+@contextmanager
+def profile(path, name, profiler='cprofile'):
+	"""
+	在剖析器下执行其中的代码，结果以name为文件名保存在path目录
+	profiler为cprofile或pyinstrument，pyinstrument未安装时使用cprofile
+	"""
+	if profiler == 'pyinstrument':
+		try:
+			from pyinstrument import Profiler
+		except ImportError:
+			logger.warning('pyinstrument is not installed, use cprofile instead')
+			profiler = 'cprofile'
+	os.makedirs(path, exist_ok=True)
+	prefix = os.path.join(path, name)
+	if profiler == 'pyinstrument':
+		p = Profiler()
+		p.start()
+		try:
+			yield
+		finally:
+			p.stop()
+			with open(prefix + '.html', 'w', encoding='utf-8') as file:
+				file.write(p.output_html())
+			with open(prefix + '.txt', 'w', encoding='utf-8') as file:
+				file.write(p.output_text())
+			logger.info('Save profile to {}.html'.format(prefix))
+	else:
+		p = cProfile.Profile()
+		p.enable()
+		try:
+			yield
+		finally:
+			p.disable()
+			p.dump_stats(prefix + '.prof')
+			stream = io.StringIO()
+			pstats.Stats(p, stream=stream).sort_stats('cumulative').print_stats(100)
+			with open(prefix + '.txt', 'w', encoding='utf-8') as file:
+				file.write(stream.getvalue())
+			logger.info('Save profile to {}.prof'.format(prefix))
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import threading
+
+from knowledge_fusion.utils.utils import get_cur_time_rep
+
+
+class SQLiteConnection:
+	"""
+	按进程打开的SQLite连接，首次使用时才连接；连接不能跨进程共享，fork出的进程中重新连接
+	"""
+
+	def __init__(self, path, timeout=5.0):
+		self.path = path
+		self.lock = threading.Lock()
+		self._timeout = timeout
+		self._pid = None
+		self._con = None
+
+	def connect(self):
+		pid = os.getpid()
+		if self._pid != pid:
+			self._con = sqlite3.connect(self.path, timeout=self._timeout, check_same_thread=False)
+			self._pid = pid
+		return self._con
+
+	def close(self):
+		"""
+		关闭当前进程打开的连接，从父进程继承的连接只丢弃
+		"""
+		if self._con is not None and self._pid == os.getpid():
+			self._con.close()
+		self._con = None
+		self._pid = None
+
+
+class SQLiteStore(SQLiteConnection):
+	"""
+	SQLite文件中的键值表(key, column, create_time)，多个worker与多个进程共享同一个文件
+	"""
+
+	def __init__(self, path, table, column='value', column_type='text', timeout=30.0):
+		super().__init__(path, timeout)
+		self._table = table
+		self._column = column
+		with self.lock:
+			con = self.connect()
+			con.execute('create table if not exists {}(key text primary key, {} {}, create_time date);'.format(table, column, column_type))
+			con.commit()
+
+	def get(self, key):
+		"""
+		查询键对应的值，不存在时返回None
+		"""
+		with self.lock:
+			row = self.connect().execute('select {} from {} where key=?;'.format(self._column, self._table), (key,)).fetchone()
+		return None if row is None else row[0]
+
+	def put(self, key, value):
+		with self.lock:
+			con = self.connect()
+			con.execute('insert or replace into {} values (?, ?, ?);'.format(self._table), (key, value, get_cur_time_rep()))
+			con.commit()
+
+	def clear(self):
+		with self.lock:
+			con = self.connect()
+			con.execute('delete from {};'.format(self._table))
+			con.commit()
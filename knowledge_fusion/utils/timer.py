@@ -0,0 +1,117 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# 各阶段的计时，stage -> [次数, 秒数]，任务开始时由reset清空
+_lock = threading.Lock()
+_local = threading.local()
+_stages = {}
+_pairs = {}
+# 任务中的计数，name -> 值
+_counters = {}
+
+
+@contextmanager
+def span(stage):
+	"""
+	记录一段代码的耗时，计入当前任务的总计，在pair之内时同时计入当前表对
+	阶段可以嵌套，每个阶段的耗时包含其中嵌套的阶段
+	"""
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		_record(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+	"""
+	span的装饰器形式
+	"""
+	def decorate(func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			with span(stage):
+				return func(*args, **kwargs)
+
+		return wrapper
+
+	return decorate
+
+
+@contextmanager
+def pair(table_id_1, table_id_2):
+	"""
+	其中记录的阶段同时按表对汇总，整个表对的耗时记为match阶段
+	"""
+	previous = getattr(_local, 'pair', None)
+	_local.pair = (table_id_1, table_id_2)
+	try:
+		with span('match'):
+			yield
+	finally:
+		_local.pair = previous
+
+
+def count(name, value=1):
+	"""
+	累加当前任务的计数，例如获取表数据的次数
+	"""
+	with _lock:
+		_counters[name] = _counters.get(name, 0) + value
+
+
+def reset():
+	with _lock:
+		_stages.clear()
+		_pairs.clear()
+		_counters.clear()
+
+
+def summary():
+	"""
+	当前任务各阶段的次数与秒数，每个表对各阶段的次数与秒数，以及任务中的计数
+	"""
+	with _lock:
+		return {
+			'stages': _format(_stages),
+			'counters': dict(_counters),
+			'pairs': [{'tables': list(key), 'stages': _format(stages)} for key, stages in _pairs.items()]
+		}
+
+
+def merge(other):
+	"""
+	将其他进程的summary计入当前任务，例如进程池中子进程的计时
+	合并后各阶段的秒数是所有进程耗时之和，可能大于任务实际经过的时间
+	"""
+	with _lock:
+		for stage, item in other['stages'].items():
+			_add(_stages, stage, item['seconds'], item['count'])
+		for pair_item in other['pairs']:
+			stages = _pairs.setdefault(tuple(pair_item['tables']), {})
+			for stage, item in pair_item['stages'].items():
+				_add(stages, stage, item['seconds'], item['count'])
+		for name, value in other['counters'].items():
+			_counters[name] = _counters.get(name, 0) + value
+
+
+def _record(stage, seconds):
+	key = getattr(_local, 'pair', None)
+	with _lock:
+		_add(_stages, stage, seconds)
+		if key is not None:
+			_add(_pairs.setdefault(key, {}), stage, seconds)
+
+
+def _add(stages, stage, seconds, count=1):
+	item = stages.get(stage)
+	if item is None:
+		item = stages[stage] = [0, 0.0]
+	item[0] += count
+	item[1] += seconds
+
+
+def _format(stages):
+	return {stage: {'count': count, 'seconds': round(seconds, 6)} for stage, (count, seconds) in stages.items()}
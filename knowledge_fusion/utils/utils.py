@@ -1,8 +1,15 @@
+import hashlib
 import json
 import os
 import time
+from contextlib import contextmanager
 from functools import wraps
 
+try:
+	import fcntl
+except ImportError:  # Windows下没有fcntl，退化为不加锁
+	fcntl = None
+
 
 def get_cur_time_rep():
 	return time.strftime('%Y-%m-%d %H:%M:%S')
@@ -43,4 +50,48 @@ def write_json(data, filename, encoding='utf-8'):
 
 def read_json(filename, encoding='utf-8'):
 	with open(filename, encoding=encoding) as file:
-		return json.load(file)
\ No newline at end of file
+		return json.load(file)
+
+
+def content_hash(obj, data=b''):
+	"""
+	可序列化为JSON的对象与可选的字节串的哈希，不依赖PYTHONHASHSEED，用作内容的版本与持久化的键
+	"""
+	h = hashlib.blake2b(json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8'), digest_size=16)
+	h.update(data)
+	return h.hexdigest()
+
+
+def file_version(path):
+	"""
+	文件的大小与修改时间，目录取其中所有文件的总大小与最晚的修改时间，不存在时返回None
+	"""
+	if os.path.isfile(path):
+		stat = os.stat(path)
+		return [stat.st_size, stat.st_mtime_ns]
+	if os.path.isdir(path):
+		size, mtime = 0, 0
+		for root, dirs, files in os.walk(path):
+			for name in files:
+				stat = os.stat(os.path.join(root, name))
+				size, mtime = size + stat.st_size, max(mtime, stat.st_mtime_ns)
+		return [size, mtime]
+	return None
+
+
+@contextmanager
+def file_lock(path):
+	"""
+	以path为锁文件的跨进程排他锁，path为None或没有fcntl时不加锁
+	"""
+	if path is None:
+		yield
+		return
+	with open(path, 'a') as file:
+		if fcntl is not None:
+			fcntl.flock(file, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			if fcntl is not None:
+				fcntl.flock(file, fcntl.LOCK_UN)